@@ -0,0 +1,7 @@
+# coding: utf-8
+"""
+Benchmarks of the main endpoints against seeded datasets.
+
+Run them with ``python -m benchmarks run`` and compare two runs with
+``python -m benchmarks compare``, see ``python -m benchmarks --help``.
+"""
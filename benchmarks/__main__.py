@@ -0,0 +1,86 @@
+# coding: utf-8
+
+import json
+import click
+from .dataset import SIZES
+from .compare import compare, format_row
+
+
+@click.group()
+def cli():
+    """Benchmarks of the main endpoints."""
+
+
+@cli.command()
+@click.option('--size', 'sizes', multiple=True, type=click.Choice(sorted(SIZES)),
+              help='Dataset sizes to run, small by default. Repeatable.')
+@click.option('--database-uri', help='Database to run against, its tables are '
+              'dropped and reseeded. A temporary SQLite file by default.')
+@click.option('--iterations', default=50, help='Timed requests per scenario.')
+@click.option('--warmup', default=5, help='Untimed requests per scenario first.')
+@click.option('--seed', default=0, help='Seed of the dataset.')
+@click.option('--scenario', 'names', multiple=True, help='Only run these scenarios.')
+@click.option('--output', '-o', type=click.Path(), help='Write the results to this JSON file.')
+def run(sizes, database_uri, iterations, warmup, seed, names, output):
+    """Seed a dataset and benchmark the endpoints."""
+    from .runner import run as run_benchmarks
+    rv = run_benchmarks(
+        sizes or ['small'], database_uri, iterations, warmup, seed, names, click.echo)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(rv, f, indent=2, sort_keys=True)
+        click.echo('Results written to {}'.format(output))
+
+
+@cli.command('compare')
+@click.argument('base', type=click.File())
+@click.argument('new', type=click.File())
+@click.option('--threshold', default=0.2, help='Largest relative slowdown allowed.')
+def compare_command(base, new, threshold):
+    """Compare two results, fail on regressions."""
+    rows, regressions = compare(json.load(base), json.load(new), threshold)
+    for row in rows:
+        click.echo(format_row(row))
+    if regressions:
+        click.echo('{} regressions over {:.0%}.'.format(len(regressions), threshold), err=True)
+        raise SystemExit(1)
+    click.echo('No regressions.')
+
+
+@cli.command('load')
+@click.argument('url')
+@click.option('--concurrency', '-c', default=50, help='Concurrent connections.')
+@click.option('--duration', '-d', default=10.0, help='Seconds to run.')
+def load_command(url, concurrency, duration):
+    """Load a running server."""
+    from .load import load
+    rv = load(url, concurrency, duration)
+    click.echo('{rps} req/s  p50 {p50_ms} ms  p95 {p95_ms} ms  '
+               '{requests} requests  {errors} errors'.format(**rv))
+
+
+@cli.command('workers')
+@click.option('--path', default='/', help='Path to request.')
+@click.option('--workers', '-w', default=2, help='gunicorn workers.')
+@click.option('--concurrency', '-c', default=50, help='Concurrent connections.')
+@click.option('--duration', '-d', default=10.0, help='Seconds per worker class.')
+@click.option('--db-latency', default=0.005, help='Seconds added to every statement.')
+@click.option('--output', '-o', type=click.Path(), help='Write the results to this JSON file.')
+def workers_command(path, workers, concurrency, duration, db_latency, output):
+    """Compare sync and gevent gunicorn workers under the same load.
+
+    The app reads its config, and database, from WEBSITE_CONF.
+    """
+    from .load import compare_workers
+    rv = compare_workers(path, ('sync', 'gevent'), workers, concurrency,
+                         duration, db_latency, click.echo)
+    if rv.get('sync') and rv['sync']['rps']:
+        click.echo('gevent serves {:.1f}x the requests of sync.'.format(
+            rv['gevent']['rps'] / rv['sync']['rps']))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(rv, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,46 @@
+# coding: utf-8
+"""
+Compare two benchmark result files.
+"""
+
+#: metric -> smallest absolute increase that counts, below it is noise
+METRICS = (
+    ('p50_ms', 0.5),
+    ('p95_ms', 1.0),
+    ('queries', 0),
+    ('peak_kb', 64),
+)
+
+
+def compare(base, new, threshold=0.2):
+    """Return ``(rows, regressions)``. A metric regresses when it grew by
+    more than ``threshold`` relative to ``base`` and by more than its
+    noise floor. Query counts are exact, any increase is a regression.
+    """
+    rows, regressions = [], []
+    for size, scenarios in sorted(new['results'].items()):
+        base_scenarios = base['results'].get(size, {})
+        for name, values in sorted(scenarios.items()):
+            before = base_scenarios.get(name)
+            if before is None:
+                continue
+            for metric, floor in METRICS:
+                a, b = before.get(metric), values.get(metric)
+                if a is None or b is None:
+                    continue
+                change = (b - a) / a if a else (1.0 if b else 0.0)
+                if metric == 'queries':
+                    regressed = b > a
+                else:
+                    regressed = change > threshold and b - a > floor
+                row = (size, name, metric, a, b, change, regressed)
+                rows.append(row)
+                if regressed:
+                    regressions.append(row)
+    return rows, regressions
+
+
+def format_row(row):
+    size, name, metric, a, b, change, regressed = row
+    return '{:<7} {:<18} {:<8} {:>10} {:>10} {:>+7.1%}{}'.format(
+        size, name, metric, a, b, change, '  REGRESSION' if regressed else '')
@@ -0,0 +1,105 @@
+# coding: utf-8
+"""
+Seeded datasets. The same size and seed always produce the same rows, on
+SQLite and PostgreSQL alike, so runs on different commits are comparable.
+"""
+
+import random
+import datetime
+from website.models import db, User, Project, Star, Trending
+
+#: name -> (users, projects, stars)
+SIZES = {
+    'small': (50, 200, 1000),
+    'medium': (500, 2000, 20000),
+    'large': (5000, 20000, 200000),
+}
+
+#: stars of user 1, capped by the projects and half the stars of a size.
+#: The profile page should cost the same for them as for anyone else
+COLLECTOR_STARS = 5000
+
+WORDS = (
+    'campus robot solar app food network study music drone health '
+    'game market water bike art data cloud vision tutor energy club '
+    'event design lab mobile ocean space voice green social maker'
+).split()
+
+#: stars are spread over this many days before the dataset's now
+STAR_DAYS = 30
+
+BATCH_SIZE = 1000
+
+
+def _sentence(rnd, n):
+    return ' '.join(rnd.choice(WORDS) for _ in range(n)).capitalize()
+
+
+def _insert(table, rows):
+    for i in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(table.insert(), rows[i:i + BATCH_SIZE])
+
+
+def seed(size, seed=0):
+    """Fill the empty tables with the ``size`` dataset. Star counts are
+    popularity skewed, a few projects get most of the stars like on the
+    real site, and the trending leaderboard is built from them. Returns
+    ``(users, projects, stars)``.
+    """
+    n_users, n_projects, n_stars = SIZES[size]
+    rnd = random.Random(seed)
+    now = datetime.datetime(2019, 6, 1)
+
+    users = [dict(
+        id=i, email='user{}@example.com'.format(i), name='User {}'.format(i),
+        picture='https://example.com/u/{}.png'.format(i),
+        major=rnd.choice(WORDS), year=str(rnd.randint(2019, 2023)),
+        updated_at=now,
+    ) for i in range(1, n_users + 1)]
+
+    projects = [dict(
+        id=i, userid=rnd.randint(1, n_users), title=_sentence(rnd, 3),
+        description=_sentence(rnd, 30), name=_sentence(rnd, 2),
+        picture='https://example.com/p/{}.png'.format(i),
+        url='https://example.com/{}'.format(i), star_count=0,
+        updated_at=now,
+    ) for i in range(1, n_projects + 1)]
+
+    n_stars = min(n_stars, n_users * n_projects)
+    collected = min(COLLECTOR_STARS, n_projects, n_stars // 2)
+    pairs = set((1, p) for p in rnd.sample(range(1, n_projects + 1), collected))
+    while len(pairs) < n_stars:
+        if rnd.random() < 0.5:
+            projectid = rnd.randint(1, n_projects)
+        else:
+            # half the stars go to a long tailed few, by paretovariate
+            rank = min(int(rnd.paretovariate(1.2)), n_projects)
+            projectid = (rank * 7919) % n_projects + 1
+        pairs.add((rnd.randint(1, n_users), projectid))
+
+    stars = [dict(id=i, userid=u, projectid=p, updated_at=now,
+                  created_at=now - datetime.timedelta(seconds=rnd.randint(0, STAR_DAYS * 86400)))
+             for i, (u, p) in enumerate(sorted(pairs), 1)]
+    for star in stars:
+        projects[star['projectid'] - 1]['star_count'] += 1
+
+    _insert(User.__table__, users)
+    _insert(Project.__table__, projects)
+    _insert(Star.__table__, stars)
+    db.session.commit()
+
+    if db.engine.dialect.name == 'postgresql':
+        # rows were inserted with explicit ids
+        for table in ('user', 'project', 'star'):
+            db.session.execute(
+                "SELECT setval(pg_get_serial_sequence('\"{0}\"', 'id'), "
+                "(SELECT max(id) FROM \"{0}\"))".format(table))
+        db.session.commit()
+
+    Trending.rebuild(now=now)
+    return len(users), len(projects), len(stars)
+
+
+def reset():
+    db.drop_all()
+    db.create_all()
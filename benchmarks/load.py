@@ -0,0 +1,117 @@
+# coding: utf-8
+"""
+Concurrent load against a running server, and a comparison of gunicorn
+worker classes on the same app.
+"""
+
+import os
+import sys
+import time
+import socket
+import threading
+import subprocess
+from urllib.parse import urlsplit
+from http.client import HTTPConnection
+from .runner import percentile
+
+
+def load(url, concurrency=50, duration=10.0):
+    """Request ``url`` from ``concurrency`` threads, each on a keep-alive
+    connection, for ``duration`` seconds.
+    """
+    parts = urlsplit(url)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    deadline = time.perf_counter() + duration
+    timings, errors = [], [0]
+    lock = threading.Lock()
+
+    def worker():
+        conn = HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+        local = []
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                conn.request('GET', path)
+                resp = conn.getresponse()
+                resp.read()
+                ok = resp.status < 500
+            except (OSError, IOError):
+                conn.close()
+                conn = HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+                ok = False
+            if ok:
+                local.append(time.perf_counter() - start)
+            else:
+                with lock:
+                    errors[0] += 1
+        conn.close()
+        with lock:
+            timings.extend(local)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    return dict(
+        concurrency=concurrency,
+        requests=len(timings),
+        errors=errors[0],
+        rps=round(len(timings) / elapsed, 1),
+        p50_ms=round(percentile(timings, 0.5) * 1000, 2),
+        p95_ms=round(percentile(timings, 0.95) * 1000, 2),
+    )
+
+
+def _free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def _wait_for(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn did not start on port {}'.format(port))
+
+
+def compare_workers(path='/', worker_classes=('sync', 'gevent'), workers=2,
+                    concurrency=50, duration=10.0, db_latency=0.0, log=print):
+    """Start gunicorn with each worker class on ``benchmarks.loadapp``
+    and load it. The app reads its config from ``WEBSITE_CONF``.
+    """
+    results = {}
+    env = dict(os.environ, LOAD_DB_LATENCY=str(db_latency))
+    for worker_class in worker_classes:
+        port = _free_port()
+        cmd = [
+            sys.executable, '-m', 'gunicorn', 'benchmarks.loadapp:app',
+            '-b', '127.0.0.1:{}'.format(port), '-w', str(workers),
+            '-k', worker_class, '--worker-connections', str(concurrency),
+            '--log-level', 'warning',
+        ]
+        proc = subprocess.Popen(cmd, env=env)
+        try:
+            _wait_for(port)
+            url = 'http://127.0.0.1:{}{}'.format(port, path)
+            # warm up every worker
+            load(url, workers * 2, 1)
+            results[worker_class] = rv = load(url, concurrency, duration)
+            log('{:<8} {:>8} req/s  p50 {:>8} ms  p95 {:>8} ms  {} errors'.format(
+                worker_class, rv['rps'], rv['p50_ms'], rv['p95_ms'], rv['errors']))
+        finally:
+            proc.terminate()
+            proc.wait()
+    return results
@@ -0,0 +1,29 @@
+# coding: utf-8
+"""
+The app for load tests, ``gunicorn benchmarks.loadapp:app``.
+
+``LOAD_DB_LATENCY`` adds that many seconds before every statement,
+``pg_sleep`` on PostgreSQL, to stand in for a database across the
+network. Waiting is where gevent workers win, with a local database
+and tiny queries there is little to overlap.
+"""
+
+import os
+import time
+from sqlalchemy import event
+from website import create_app
+from website.models import db
+
+app = create_app()
+
+latency = float(os.environ.get('LOAD_DB_LATENCY') or 0)
+if latency:
+    with app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def add_latency(conn, cursor, statement, parameters, context, executemany):
+        if engine.dialect.name == 'postgresql':
+            cursor.execute('SELECT pg_sleep(%s)', (latency,))
+        else:
+            time.sleep(latency)
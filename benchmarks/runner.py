@@ -0,0 +1,215 @@
+# coding: utf-8
+"""
+Drive the Flask test client through the main endpoints and measure
+latency, SQL queries and peak memory of each request.
+"""
+
+import os
+import sys
+import time
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+from sqlalchemy import event, func
+from website import create_app
+from website.auth import user_cache
+from website.models import db, Star
+from website.search import search_index
+from . import dataset
+
+
+class Scenario(object):
+    """One request, repeated. ``setup(ctx)`` runs once against the
+    seeded database and returns the path, so scenarios can pick ids.
+    With ``login``, requests are made as the user ``user()`` returns,
+    the one with the most stars by default.
+    """
+
+    def __init__(self, name, path, method='GET', login=False, headers=None, user=None):
+        self.name = name
+        self.path = path
+        self.method = method
+        self.login = login
+        self.headers = headers or {}
+        self.user = user
+
+    def setup(self, ctx):
+        if callable(self.path):
+            return self.path(ctx)
+        return self.path
+
+
+def _user_by_stars(most):
+    count = func.count()
+    row = db.session.query(Star.userid, count).group_by(Star.userid) \
+        .order_by(count.desc() if most else count, Star.userid).first()
+    return row[0] if row else 1
+
+
+def _busiest_user():
+    return _user_by_stars(most=True)
+
+
+def _quietest_user():
+    return _user_by_stars(most=False)
+
+
+SCENARIOS = [
+    Scenario('home.anonymous', '/'),
+    Scenario('home.user', '/', login=True),
+    Scenario('home.trending', '/?tab=trending'),
+    Scenario('home.week', '/?tab=week', login=True),
+    Scenario('feed.page2', lambda ctx: '/feed?after=' + ctx['cursor']),
+    Scenario('project.star', lambda ctx: '/project/star/{}'.format(ctx['project_id']),
+             method='POST', login=True, headers={'Accept': 'application/json'}),
+    Scenario('project.search', '/project/search?q=solar+rob'),
+    # the same page for the user with the most stars and the fewest
+    Scenario('account.profile', '/account/profile', login=True),
+    Scenario('account.profile.few', '/account/profile', login=True, user=_quietest_user),
+    Scenario('api.projects', '/api/projects'),
+]
+
+
+class QueryCounter(object):
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return 0
+    k = (len(values) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def create_benchmark_app(database_uri):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': database_uri,
+        'SECRET_KEY': 'benchmark',
+        'WTF_CSRF_ENABLED': False,
+        'OAUTH_CACHE_URL': 'memory://',
+        # rebuild the search index only when it is empty, no timers
+        'SEARCH_INDEX_MAX_AGE': 0,
+        'STAR_RECONCILE_INTERVAL': 0,
+        'TRENDING_REBUILD_INTERVAL': 0,
+    })
+    search_index.invalidate()
+    user_cache.configure(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+    return app
+
+
+def run_scenario(client, counter, scenario, path, user_id, iterations, warmup):
+    if scenario.login:
+        with client.session_transaction() as sess:
+            sess['sid'] = user_id
+    else:
+        with client.session_transaction() as sess:
+            sess.pop('sid', None)
+
+    def request():
+        resp = client.open(path, method=scenario.method, headers=scenario.headers)
+        if resp.status_code >= 400:
+            raise RuntimeError('{} {} returned {}'.format(
+                scenario.method, path, resp.status_code))
+
+    for _ in range(warmup):
+        request()
+
+    timings, queries = [], []
+    for _ in range(iterations):
+        before = counter.count
+        start = time.perf_counter()
+        request()
+        timings.append((time.perf_counter() - start) * 1000)
+        queries.append(counter.count - before)
+
+    # tracing slows everything down, measure memory in a separate pass
+    tracemalloc.start()
+    for _ in range(max(1, iterations // 10)):
+        request()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return dict(
+        n=iterations,
+        p50_ms=round(percentile(timings, 0.5), 3),
+        p95_ms=round(percentile(timings, 0.95), 3),
+        mean_ms=round(sum(timings) / len(timings), 3),
+        queries=round(sum(queries) / len(queries), 2),
+        peak_kb=round(peak / 1024.0, 1),
+    )
+
+
+def run_size(size, database_uri, iterations, warmup, seed, names=None, log=print):
+    app = create_benchmark_app(database_uri)
+    with app.app_context():
+        dataset.reset()
+        counts = dataset.seed(size, seed)
+        counter = QueryCounter(db.engine)
+        client = app.test_client()
+        feed = client.get('/feed')
+        ctx = dict(
+            cursor=feed.headers.get('X-Next-Cursor', ''),
+            project_id=1,
+        )
+        scenarios = [(s, s.setup(ctx), (s.user or _busiest_user)())
+                     for s in SCENARIOS if not names or s.name in names]
+
+    log('{}: {} users, {} projects, {} stars'.format(size, *counts))
+    results = {}
+    for scenario, path, user_id in scenarios:
+        # every request gets its own app context, like in production
+        results[scenario.name] = rv = run_scenario(
+            client, counter, scenario, path, user_id, iterations, warmup)
+        log('  {:<20} p50 {:>8.2f} ms  p95 {:>8.2f} ms  {:>6} queries  {:>8} KB'.format(
+            scenario.name, rv['p50_ms'], rv['p95_ms'], rv['queries'], rv['peak_kb']))
+
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+    return results
+
+
+def git_revision():
+    try:
+        out = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL)
+        return out.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, database_uri=None, iterations=50, warmup=5, seed=0, names=None, log=print):
+    tmpdir = None
+    if not database_uri:
+        tmpdir = tempfile.mkdtemp(prefix='benchmarks-')
+        database_uri = 'sqlite:///' + os.path.join(tmpdir, 'bench.db')
+
+    try:
+        results = {}
+        for size in sizes:
+            results[size] = run_size(size, database_uri, iterations, warmup, seed, names, log)
+    finally:
+        if tmpdir:
+            for name in os.listdir(tmpdir):
+                os.remove(os.path.join(tmpdir, name))
+            os.rmdir(tmpdir)
+
+    meta = dict(
+        revision=git_revision(),
+        time=time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        python=sys.version.split()[0],
+        platform=platform.platform(),
+        database=database_uri.split(':', 1)[0],
+        iterations=iterations,
+        seed=seed,
+    )
+    return dict(meta=meta, results=results)
@@ -1,7 +1,6 @@
 import os
-import json
-import hashlib
-from fabric.api import env, local, cd, run
+import time
+from fabric.api import env, local, cd, run, abort
 from fabric.operations import put
 
 env.use_ssh_config = True
@@ -11,74 +10,36 @@ env.hosts = ['authlib-web-p0']
 DOMAIN = 'play.authlib.org'
 REMOTE_STATIC_DIR = '/var/www/{}/static'.format(DOMAIN)
 LOCAL_STATIC_DIR = 'public/static'
-ASSETS_FILE = 'website/static/assets.json'
+LOCAL_ASSETS_MANIFEST = 'public/assets.json'
 
 BIN_PATH = '/var/venv/playground/bin'
 BIN_PIP = '{}/pip'.format(BIN_PATH)
 BIN_FLASK = '{}/flask'.format(BIN_PATH)
 
+GUNICORN_PIDFILE = '/tmp/playground-gunicorn.pid'
 
-def build():
-    with open(ASSETS_FILE) as f:
-        data = json.load(f)
-
-    def _build_assets(key, assets):
-        print('Build: {}'.format(key))
-        css = ''
-        for name in assets['styles']:
-            file_path = 'website{}'.format(name)
-            with open(file_path) as f:
-                css += f.read()
-
-        css_file = os.path.join(LOCAL_STATIC_DIR, key + '.css')
-        with open(css_file, 'w') as f:
-            f.write(css)
 
-    for key in data:
-        _build_assets(key, data[key])
+def build():
+    """Bundle, minify, precompress and fingerprint the assets"""
+    local('FLASK_APP=website:create_app flask assets build --output {} --manifest {}'.format(
+        LOCAL_STATIC_DIR, LOCAL_ASSETS_MANIFEST))
 
 
 def upload():
     run('mkdir -p {}'.format(REMOTE_STATIC_DIR))
-    url_maps = {}
-
-    def _gen_assets(url_maps):
-        with open(ASSETS_FILE) as f:
-            assets = json.load(f)
-
-        for k in assets:
-            item = assets[k]
-            item['styles'] = [url_maps[k + '.css']]
 
-        return assets
+    # names are content addressed, a name the server has is up to date
+    remote = set(run('ls -1 {}'.format(REMOTE_STATIC_DIR), quiet=True).split())
+    missing = sorted(set(os.listdir(LOCAL_STATIC_DIR)) - remote)
+    print('Upload: {} of {} files'.format(len(missing), len(remote | set(missing))))
+    for name in missing:
+        put(os.path.join(LOCAL_STATIC_DIR, name), '{}/{}'.format(REMOTE_STATIC_DIR, name))
 
-    def _hash_put(name):
-        filepath = os.path.join(LOCAL_STATIC_DIR, name)
-        with open(filepath, 'rb') as f:
-            code = hashlib.md5(f.read()).hexdigest()
-
-        bits = name.split('.')
-        bits.insert(1, code[5:18])
-        hash_name = '.'.join(bits)
-        put(filepath, '{}/{}'.format(REMOTE_STATIC_DIR, hash_name))
-        url_maps[name] = '/static/{}'.format(hash_name)
-        return hash_name
-
-    for name in os.listdir(LOCAL_STATIC_DIR):
-        if not name.endswith('.map'):
-            _hash_put(name)
-
-    assets = _gen_assets(url_maps)
-    temp_file = 'public/assets.json'
-    with open(temp_file, 'w') as f:
-        json.dump(assets, f)
-
-    put(temp_file, '/code/playground/conf/assets.json')
+    # the manifest switches the site over, only once everything is there
+    put(LOCAL_ASSETS_MANIFEST, '/code/playground/conf/assets.json')
 
 
 def publish():
-    local('rm -fr {}'.format(LOCAL_STATIC_DIR))
-    local('mkdir -p {}'.format(LOCAL_STATIC_DIR))
     build()
     upload()
 
@@ -88,6 +49,7 @@ def deploy():
     with cd('/code/playground/src/playground'):
         run('git pull origin master')
         run('{} install -r requirements.txt'.format(BIN_PIP))
+    flask('compile-templates')
 
 
 def flask(cmd):
@@ -97,6 +59,24 @@ def flask(cmd):
         run('%s %s %s' % (_env, BIN_FLASK, cmd))
 
 
+def _wait_for(command, timeout=120):
+    for _ in range(timeout):
+        if run(command, quiet=True, warn_only=True).succeeded:
+            return
+        time.sleep(1)
+    abort('Timed out waiting for: {}'.format(command))
+
+
 def restart():
-    env.user = 'lepture'
-    run('sudo supervisorctl pid playground | sudo xargs kill -s HUP')
+    """Switch gunicorn to the new code without dropping a connection"""
+    # workers fork from a master that preloaded the app, HUP would only
+    # fork them again from the old code. USR2 starts a new master on the
+    # same socket instead, it runs next to the old one until that stops
+    old = run('cat {}'.format(GUNICORN_PIDFILE)).strip()
+    run('kill -USR2 {}'.format(old))
+    # the new master has workers once it preloaded the app
+    _wait_for('pgrep -P "$(cat {}.2)"'.format(GUNICORN_PIDFILE))
+    # TERM lets the old workers finish their requests, WINCH is ignored
+    # by a master that is not daemonized and QUIT is a quick shutdown
+    run('kill -TERM {}'.format(old))
+    _wait_for('test "$(cat {})" != {}'.format(GUNICORN_PIDFILE, old))
@@ -13,7 +13,8 @@ if is_dev:
 
     @app.after_request
     def add_header(resp):
-        resp.headers['Cache-Control'] = 'no-store'
+        # keep the validators of conditional pages usable in development
+        resp.headers.setdefault('Cache-Control', 'no-store')
         resp.headers['Pragma'] = 'no-cache'
         return resp
 else:
@@ -0,0 +1,249 @@
+# coding: utf-8
+"""
+Image proxy tests, against an ``http.server`` standing in for the sites
+pictures are hosted on.
+"""
+
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from collections import Counter
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlencode, urlsplit, parse_qs
+from PIL import Image
+from website import create_app
+from website.images import image_cache, sign, url_hash, ImageError
+
+
+def make_jpeg(width=600, height=400, seed=0):
+    img = Image.new('RGB', (width, height), (seed * 37 % 256, 120, 200))
+    # noise keeps the file from compressing to almost nothing
+    img.putdata([((x * 7 + seed) % 256, (x * 13) % 256, (x * 3 + seed * 11) % 256)
+                 for x in range(width * height)])
+    out = io.BytesIO()
+    img.save(out, 'JPEG', quality=90)
+    return out.getvalue()
+
+
+class Origin(BaseHTTPRequestHandler):
+    hits = Counter()
+    hosts = []
+    photo = make_jpeg()
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        self.hits[self.path] += 1
+        self.hosts.append(self.headers['Host'])
+        if parts.path == '/photo.jpg':
+            self.reply(200, 'image/jpeg', self.photo)
+        elif parts.path == '/redirect':
+            self.send_response(302)
+            self.send_header('Location', parse_qs(parts.query).get('to', ['/photo.jpg'])[0])
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        elif parts.path == '/page.html':
+            self.reply(200, 'text/html', b'<html></html>')
+        else:
+            self.reply(500, 'text/plain', b'broken')
+
+    def reply(self, status, ctype, body):
+        self.send_response(status)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ImageProxyTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(('127.0.0.1', 0), Origin)
+        cls.origin = 'http://127.0.0.1:{}'.format(cls.server.server_port)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        Origin.hits.clear()
+        del Origin.hosts[:]
+        self.cache_dir = tempfile.mkdtemp()
+        self.app = self.create_app()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def create_app(self, **config):
+        config = dict({
+            'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+            'SECRET_KEY': 'test',
+            'OAUTH_CACHE_URL': 'memory://',
+            'IMAGE_CACHE_DIR': self.cache_dir,
+            # the origin is on localhost
+            'IMAGE_ALLOW_PRIVATE': True,
+        }, **config)
+        return create_app(config)
+
+    def get(self, path, size=96, accept='image/webp,*/*', signature=None, **headers):
+        url = self.origin + path
+        if signature is None:
+            signature = sign(self.app.secret_key, url, size)
+        headers['Accept'] = accept
+        query = urlencode(dict(url=url, s=signature))
+        return self.client.get('/image/{}?{}'.format(size, query), headers=headers)
+
+    def test_fetches_each_source_once(self):
+        for size in (96, 160):
+            for accept in ('image/webp', 'image/jpeg'):
+                for _ in range(2):
+                    resp = self.get('/photo.jpg', size=size, accept=accept)
+                    self.assertEqual(resp.status_code, 200)
+                    resp.close()
+        self.assertEqual(Origin.hits['/photo.jpg'], 1)
+
+    def test_thumbnail_is_resized(self):
+        resp = self.get('/photo.jpg', size=160, accept='image/jpeg')
+        self.assertEqual(Image.open(io.BytesIO(resp.data)).size, (160, 160))
+        self.assertLess(len(resp.data), len(Origin.photo))
+
+    def test_negotiates_webp_and_jpeg(self):
+        resp = self.get('/photo.jpg', accept='image/webp,*/*')
+        self.assertEqual(resp.mimetype, 'image/webp')
+        self.assertEqual(Image.open(io.BytesIO(resp.data)).format, 'WEBP')
+        self.assertIn('Accept', resp.vary)
+
+        # */* alone matches webp too, but only an explicit webp counts
+        resp = self.get('/photo.jpg', accept='*/*')
+        self.assertEqual(resp.mimetype, 'image/jpeg')
+        self.assertEqual(Image.open(io.BytesIO(resp.data)).format, 'JPEG')
+
+    def test_cache_headers_and_revalidation(self):
+        resp = self.get('/photo.jpg')
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.cache_control.public)
+        self.assertEqual(resp.cache_control.max_age, self.app.config['IMAGE_MAX_AGE'])
+        etag = resp.headers['ETag']
+        resp.close()
+
+        resp = self.get('/photo.jpg', **{'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, b'')
+        self.assertEqual(Origin.hits['/photo.jpg'], 1)
+
+    def test_bad_signature(self):
+        resp = self.get('/photo.jpg', signature='0' * 20)
+        self.assertEqual(resp.status_code, 403)
+        resp = self.get('/photo.jpg', size=160, signature=sign(self.app.secret_key, self.origin + '/photo.jpg', 96))
+        self.assertEqual(resp.status_code, 403)
+        self.assertEqual(Origin.hits['/photo.jpg'], 0)
+
+    def test_unknown_size(self):
+        self.assertEqual(self.get('/photo.jpg', size=100).status_code, 404)
+
+    def test_not_an_image(self):
+        self.assertEqual(self.get('/page.html').status_code, 404)
+
+    def test_failed_fetch_is_cached(self):
+        for _ in range(3):
+            self.assertEqual(self.get('/missing.jpg').status_code, 404)
+        self.assertEqual(Origin.hits['/missing.jpg'], 1)
+
+        # the source is tried again once IMAGE_FAILURE_TTL has passed
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith('.err'):
+                    path = os.path.join(root, name)
+                    st = os.stat(path)
+                    os.utime(path, (st.st_atime, st.st_mtime - image_cache.failure_ttl))
+        self.assertEqual(self.get('/missing.jpg').status_code, 404)
+        self.assertEqual(Origin.hits['/missing.jpg'], 2)
+
+    def test_follows_redirects(self):
+        resp = self.get('/redirect')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(Origin.hits['/photo.jpg'], 1)
+
+    def test_rejects_private_addresses(self):
+        self.app = self.create_app(IMAGE_ALLOW_PRIVATE=False)
+        self.client = self.app.test_client()
+        self.assertEqual(self.get('/photo.jpg').status_code, 404)
+        self.assertEqual(Origin.hits['/photo.jpg'], 0)
+
+        for url in ('http://10.0.0.1/a.jpg', 'http://169.254.169.254/latest',
+                    'http://[::1]/a.jpg', 'http://[::ffff:192.168.0.1]/a.jpg',
+                    'file:///etc/passwd'):
+            with self.assertRaises(ImageError):
+                image_cache.check_url(url)
+
+    def test_checks_every_redirect_hop(self):
+        self.app = self.create_app(IMAGE_ALLOW_PRIVATE=False)
+        self.client = self.app.test_client()
+        check_url = image_cache.check_url
+        checked = []
+
+        def check_url_but_localhost(url):
+            # localhost plays a public site that redirects to 127.0.0.1
+            checked.append(url)
+            if urlsplit(url).hostname == 'localhost':
+                return '127.0.0.1'
+            return check_url(url)
+
+        image_cache.check_url = check_url_but_localhost
+        try:
+            url = 'http://localhost:{}/redirect?{}'.format(
+                self.server.server_port, urlencode(dict(to=self.origin + '/photo.jpg')))
+            query = urlencode(dict(url=url, s=sign(self.app.secret_key, url, 96)))
+            resp = self.client.get('/image/96?' + query)
+        finally:
+            del image_cache.check_url
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(checked, [url, self.origin + '/photo.jpg'])
+        self.assertEqual(Origin.hits['/photo.jpg'], 0)
+
+    def test_connects_to_the_checked_address(self):
+        # the name does not resolve, a second lookup would fail
+        url = 'http://rebind.invalid:{}/photo.jpg'.format(self.server.server_port)
+        image_cache.check_url = lambda url: '127.0.0.1'
+        try:
+            query = urlencode(dict(url=url, s=sign(self.app.secret_key, url, 96)))
+            resp = self.client.get('/image/96?' + query)
+        finally:
+            del image_cache.check_url
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(Origin.hosts, ['rebind.invalid:{}'.format(self.server.server_port)])
+
+    def test_evicts_least_recently_used(self):
+        source_size = len(Origin.photo)
+        self.app = self.create_app(IMAGE_CACHE_SIZE=int(source_size * 3.5))
+        self.client = self.app.test_client()
+        for i in range(3):
+            self.assertEqual(self.get('/photo.jpg?n={}'.format(i)).status_code, 200)
+        # a new thumbnail size reads the source, n=1 is now the oldest
+        self.assertEqual(self.get('/photo.jpg?n=0', size=160).status_code, 200)
+        self.assertEqual(self.get('/photo.jpg?n=3').status_code, 200)
+
+        on_disk = sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(self.cache_dir) for name in names
+        )
+        self.assertLessEqual(on_disk, self.app.config['IMAGE_CACHE_SIZE'])
+
+        cached = [os.path.isfile(image_cache.path(url_hash(self.origin + '/photo.jpg?n={}'.format(i)), 'src'))
+                  for i in range(4)]
+        self.assertEqual(cached, [True, False, True, True])
+
+        self.assertEqual(self.get('/photo.jpg?n=1', size=224).status_code, 200)
+        self.assertEqual(Origin.hits['/photo.jpg?n=1'], 2)
+
+if __name__ == '__main__':
+    unittest.main()
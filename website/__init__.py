@@ -1,25 +1,57 @@
+import time
 from flask import json
 from ._flask import create_flask_app
 from .models import db
-from . import auth, routes
+from .caching import fragments
+from .search import search_index
+from . import auth, routes, migrations, tasks, assets, images, instrument, metrics, startup
 
 
-def create_app(config=None):
-    app = create_flask_app(config)
-    db.init_app(app)
-    auth.init_app(app)
-    routes.init_app(app)
-    register_hook(app)
-    return app
+def load_assets(app):
+    """The asset manifest, read on first use and kept for the process."""
+    manifest = app.extensions.get('assets_manifest')
+    if manifest is None:
+        with open(app.config['ASSETS_FILE'], 'r') as f:
+            manifest = app.extensions['assets_manifest'] = json.load(f)
+    return manifest
 
 
 def register_hook(app):
-    with open(app.config['ASSETS_FILE'], 'r') as f:
-        assets = json.load(f)
-
     @app.context_processor
     def register_context_processor():
         return dict(
-            assets=assets,
+            assets=load_assets(app),
             current_user=auth.current_user,
         )
+
+
+#: set up in this order by create_app
+EXTENSIONS = (
+    db.init_app,
+    instrument.init_app,
+    metrics.init_app,
+    fragments.init_app,
+    search_index.init_app,
+    auth.init_app,
+    routes.init_app,
+    migrations.init_app,
+    tasks.init_app,
+    assets.init_app,
+    images.init_app,
+    startup.init_app,
+    register_hook,
+)
+
+
+def create_app(config=None, timings=None):
+    """Create the app. When ``timings`` is a list, ``(name, seconds)``
+    is appended to it for every extension set up.
+    """
+    app = create_flask_app(config)
+    for init_app in EXTENSIONS:
+        start = time.perf_counter()
+        init_app(app)
+        if timings is not None:
+            name = '{}.{}'.format(init_app.__module__, init_app.__qualname__)
+            timings.append((name, time.perf_counter() - start))
+    return app
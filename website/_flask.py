@@ -2,9 +2,11 @@
 
 import datetime
 import os
+import tempfile
 
 from flask import Flask as _Flask
 from flask.json import JSONEncoder as _JSONEncoder
+from jinja2 import FileSystemBytecodeCache
 
 
 class JSONEncoder(_JSONEncoder):
@@ -20,6 +22,24 @@ class JSONEncoder(_JSONEncoder):
         return _JSONEncoder.default(self, o)
 
 
+class BytecodeCache(FileSystemBytecodeCache):
+    """Compiled templates on disk, shared by every worker of a host.
+    Files are replaced atomically so no worker reads a partial one.
+    """
+
+    def dump_bytecode(self, bucket):
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                bucket.write_bytecode(f)
+            os.replace(tmp, self._get_cache_filename(bucket))
+        except OSError:
+            # a read-only cache only serves what was compiled at deploy
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+
+
 class Flask(_Flask):
     json_encoder = JSONEncoder
     jinja_options = dict(
@@ -31,6 +51,14 @@ class Flask(_Flask):
         ]
     )
 
+    def create_jinja_environment(self):
+        env = _Flask.create_jinja_environment(self)
+        cache_dir = self.config.get('JINJA_CACHE_DIR')
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            env.bytecode_cache = BytecodeCache(cache_dir)
+        return env
+
 
 def create_flask_app(config=None):
     app = Flask(__name__)
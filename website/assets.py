@@ -0,0 +1,366 @@
+# coding: utf-8
+"""
+Static asset pipeline, run with ``flask assets build``.
+
+Every key of ``static/assets.json`` becomes one CSS and one JS bundle.
+Bundles, and the fonts and images their stylesheets reference, are
+written with a content hash in their name, next to ``.gz`` and ``.br``
+copies. The build also writes a manifest in the same shape as
+``assets.json`` that points at the bundles, set ``ASSETS_FILE`` to it.
+
+Files under ``static/vendor`` that no bundle uses are not copied.
+
+Minification uses rcssmin and rjsmin and brotli compression uses brotli,
+when they are installed. Without them bundles are only concatenated and
+gzipped.
+
+Builds are incremental. A cache file records the hash of every input of
+a bundle and the files it produced, a bundle whose inputs did not change
+is not rebuilt, and files no bundle produces any more are removed from
+the output folder. Since every name is content addressed, a deploy only
+needs to upload the names the server does not have yet.
+"""
+
+import os
+import re
+import gzip
+import json
+import shutil
+import hashlib
+import logging
+import mimetypes
+import posixpath
+import click
+from flask import request, current_app, send_from_directory
+from flask.cli import AppGroup
+
+log = logging.getLogger(__name__)
+
+cli = AppGroup('assets', help='Build the static assets.')
+
+#: files worth sending compressed, fonts like woff2 already are
+COMPRESSIBLE = ('.css', '.js', '.svg', '.eot', '.ttf', '.json', '.map')
+
+#: precompressed siblings, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+ONE_YEAR = 365 * 24 * 3600
+
+#: bump when the output of the pipeline changes, to rebuild everything
+BUILD_VERSION = 1
+
+_url_re = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+_charset_re = re.compile(r'@charset\s+[^;]+;')
+_source_map_re = re.compile(r'(?m)^\s*(//[#@]\s*sourceMappingURL=.*|/\*[#@]\s*sourceMappingURL=.*?\*/)\s*$')
+
+
+def _minify_css(text):
+    try:
+        from rcssmin import cssmin
+    except ImportError:
+        return text
+    return cssmin(text)
+
+
+def _minify_js(text):
+    try:
+        from rjsmin import jsmin
+    except ImportError:
+        return text
+    return jsmin(text)
+
+
+def content_hash(data):
+    return hashlib.md5(data).hexdigest()[:12]
+
+
+def toolchain():
+    """What the output depends on besides the inputs."""
+    rv = [BUILD_VERSION]
+    for name in ('rcssmin', 'rjsmin', 'brotli'):
+        try:
+            __import__(name)
+            rv.append(name)
+        except ImportError:
+            pass
+    return rv
+
+
+def fingerprint(name, data):
+    base, ext = os.path.splitext(name)
+    return '{}.{}{}'.format(base, content_hash(data), ext)
+
+
+class AssetBuilder(object):
+    """Build the bundles of ``assets`` into ``output_dir``.
+
+    :param static_dir: the folder served at ``static_url``, source paths
+        in ``assets.json`` are resolved against it.
+    """
+
+    def __init__(self, static_dir, output_dir, static_url='/static/', cache=None):
+        self.static_dir = static_dir
+        self.output_dir = output_dir
+        self.static_url = static_url
+        #: names of the files written, relative to output_dir
+        self.written = []
+        #: bundle name -> inputs and outputs of its last build
+        self.cache = cache if cache is not None else {}
+        #: bundles actually rebuilt
+        self.rebuilt = []
+        self._hashes = {}
+        self._deps = None
+
+    def file_hash(self, path):
+        if path not in self._hashes:
+            try:
+                with open(path, 'rb') as f:
+                    self._hashes[path] = content_hash(f.read())
+            except (IOError, OSError):
+                self._hashes[path] = None
+        return self._hashes[path]
+
+    def is_fresh(self, entry, inputs):
+        if not entry or entry['inputs'] != inputs:
+            return False
+        for path, digest in entry['deps'].items():
+            if self.file_hash(os.path.join(self.static_dir, path)) != digest:
+                return False
+        return all(
+            os.path.isfile(os.path.join(self.output_dir, name))
+            for name in entry['files']
+        )
+
+    def bundle(self, name, urls, build):
+        """Run ``build(urls)`` unless nothing it reads has changed since
+        the cached build of ``name``.
+        """
+        inputs = dict((url, self.file_hash(self.source_path(url))) for url in urls)
+        entry = self.cache.get(name)
+        if self.is_fresh(entry, inputs):
+            self.written.extend(entry['files'])
+            return entry['output']
+
+        start = len(self.written)
+        self._deps = {}
+        output = build(name, urls)
+        self.cache[name] = dict(
+            inputs=inputs, deps=self._deps, output=output,
+            files=self.written[start:],
+        )
+        self._deps = None
+        self.rebuilt.append(name)
+        return output
+
+    def source_path(self, url):
+        if not url.startswith(self.static_url):
+            raise ValueError('{} is not under {}'.format(url, self.static_url))
+        return os.path.join(self.static_dir, url[len(self.static_url):])
+
+    def write(self, name, data):
+        name = fingerprint(name, data)
+        path = os.path.join(self.output_dir, name)
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(data)
+            if name.endswith(COMPRESSIBLE):
+                self.compress(path, data)
+        self.written.append(name)
+        return name
+
+    def compress(self, path, data):
+        compressed = gzip.compress(data, 9)
+        if len(compressed) < len(data):
+            with open(path + '.gz', 'wb') as f:
+                f.write(compressed)
+        try:
+            import brotli
+        except ImportError:
+            return
+        compressed = brotli.compress(data)
+        if len(compressed) < len(data):
+            with open(path + '.br', 'wb') as f:
+                f.write(compressed)
+
+    def copy_referenced(self, css_path, text):
+        """Copy the files a stylesheet points at into the output folder
+        and rewrite its ``url()``s to the copies.
+        """
+        base_dir = os.path.dirname(css_path)
+
+        def replace(m):
+            url = m.group(2).strip()
+            if url.startswith(('data:', 'http:', 'https:', '//', '#', '/')):
+                return m.group(0)
+            path, suffix = re.match(r'([^?#]*)(.*)', url).groups()
+            source = os.path.normpath(os.path.join(base_dir, path))
+            if not os.path.isfile(source):
+                log.warning('%s references missing %s', css_path, url)
+                return m.group(0)
+            with open(source, 'rb') as f:
+                data = f.read()
+            if self._deps is not None:
+                rel = os.path.relpath(source, self.static_dir).replace(os.sep, '/')
+                self._deps[rel] = content_hash(data)
+            name = self.write(os.path.basename(source), data)
+            return 'url({}{})'.format(name, suffix)
+
+        return _url_re.sub(replace, text)
+
+    def build_css(self, name, urls):
+        chunks = []
+        for url in urls:
+            path = self.source_path(url)
+            with open(path, encoding='utf-8') as f:
+                text = f.read()
+            text = _charset_re.sub('', text)
+            text = _source_map_re.sub('', text)
+            chunks.append(self.copy_referenced(path, text))
+        css = _minify_css('\n'.join(chunks))
+        return self.write(name, css.encode('utf-8'))
+
+    def build_js(self, name, urls):
+        chunks = []
+        for url in urls:
+            with open(self.source_path(url), encoding='utf-8') as f:
+                text = _source_map_re.sub('', f.read())
+            if not url.endswith('.min.js'):
+                text = _minify_js(text)
+            # a file without a trailing semicolon must not run into the next
+            chunks.append(text.rstrip() + ';')
+        return self.write(name, '\n'.join(chunks).encode('utf-8'))
+
+    def build(self, assets):
+        """Build every bundle and return the manifest."""
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+
+        manifest = {}
+        for key, item in assets.items():
+            styles = item.get('styles', [])
+            # vendor libraries load before the site's own scripts
+            scripts = item.get('vendor', []) + item.get('scripts', [])
+            entry = dict(styles=[], scripts=[], vendor=[])
+            if styles:
+                name = self.bundle(key + '.css', styles, self.build_css)
+                entry['styles'].append(posixpath.join(self.static_url, name))
+            if scripts:
+                name = self.bundle(key + '.js', scripts, self.build_js)
+                entry['scripts'].append(posixpath.join(self.static_url, name))
+            manifest[key] = entry
+
+        # forget bundles removed from assets.json
+        names = set(self.cache) - set(
+            key + ext for key in assets for ext in ('.css', '.js'))
+        for name in names:
+            del self.cache[name]
+        return manifest
+
+    def prune(self):
+        """Remove files no bundle produces any more, return their names."""
+        keep = set(self.written)
+        keep.update(name + suffix for name in self.written for _, suffix in ENCODINGS)
+        removed = []
+        for name in os.listdir(self.output_dir):
+            if name not in keep:
+                os.remove(os.path.join(self.output_dir, name))
+                removed.append(name)
+        return removed
+
+
+def _load_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _dump_json(path, data):
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+
+def build_assets(app, output_dir, manifest_file, cache_file=None):
+    """Build the bundles into ``output_dir`` and write the manifest.
+    Returns the builder, for its ``written`` and ``rebuilt`` lists.
+    """
+    with open(app.config['ASSETS_SOURCE_FILE']) as f:
+        assets = json.load(f)
+
+    cache = {}
+    if cache_file:
+        data = _load_json(cache_file)
+        if data and data.get('toolchain') == toolchain():
+            cache = data['bundles']
+
+    builder = AssetBuilder(app.static_folder, output_dir, app.static_url_path + '/', cache)
+    manifest = builder.build(assets)
+    builder.prune()
+    _dump_json(manifest_file, manifest)
+    if cache_file:
+        _dump_json(cache_file, dict(toolchain=toolchain(), bundles=builder.cache))
+    return builder
+
+
+@cli.command('build')
+@click.option('--output', default='public/static', help='Folder for the built files.')
+@click.option('--manifest', default='public/assets.json', help='Where to write the manifest.')
+@click.option('--cache', default='public/assets-cache.json', help='Input hashes of the last build.')
+@click.option('--clean', is_flag=True, help='Empty the output folder and rebuild everything.')
+def build_command(output, manifest, cache, clean):
+    """Bundle, minify, compress and fingerprint the static assets."""
+    if clean:
+        if os.path.isdir(output):
+            shutil.rmtree(output)
+        if os.path.isfile(cache):
+            os.remove(cache)
+    builder = build_assets(current_app, output, manifest, cache)
+    for name in builder.rebuilt:
+        click.echo('Built {}: {}'.format(name, builder.cache[name]['output']))
+    click.echo('{} files in {}, {} bundles rebuilt.'.format(
+        len(set(builder.written)), output, len(builder.rebuilt)))
+
+
+def send_asset(directory, filename):
+    """Send a fingerprinted file, or its precompressed sibling when the
+    client accepts it, to be cached for a year.
+    """
+    accept = request.accept_encodings
+    path = os.path.join(directory, filename)
+    for encoding, suffix in ENCODINGS:
+        if accept[encoding] and os.path.isfile(path + suffix):
+            mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            resp = send_from_directory(
+                directory, filename + suffix, mimetype=mimetype,
+                cache_timeout=ONE_YEAR,
+            )
+            resp.headers['Content-Encoding'] = encoding
+            break
+    else:
+        resp = send_from_directory(directory, filename, cache_timeout=ONE_YEAR)
+    resp.headers['Cache-Control'] = 'public, max-age={}, immutable'.format(ONE_YEAR)
+    resp.vary.add('Accept-Encoding')
+    return resp
+
+
+def init_app(app):
+    app.cli.add_command(cli)
+
+    build_dir = app.config.get('ASSETS_BUILD_DIR')
+    if not build_dir or 'static' not in app.view_functions:
+        return
+
+    serve_static = app.view_functions['static']
+
+    def static(filename):
+        # built files are served from ASSETS_BUILD_DIR, everything else
+        # from the static folder as before
+        if os.path.isfile(os.path.join(build_dir, filename)):
+            return send_asset(build_dir, filename)
+        return serve_static(filename=filename)
+
+    app.view_functions['static'] = static
@@ -1,20 +1,69 @@
+import threading
 from functools import wraps
-from authlib.flask.client import OAuth
-from authlib.client.apps import register_apps
+from cachetools import TTLCache
+from sqlalchemy.orm import make_transient_to_detached
 from werkzeug.local import LocalProxy
 from flask import g, session
 from flask import url_for, redirect, request
-from .models import User, Connect, cache
+from .models import db, User, Connect, cache
+from .idtoken import verifier
+
+
+class UserCache(object):
+    """Per-process snapshots of the logged in users' rows.
+
+    Entries are keyed by ``(sid, version)`` where ``version`` lives in
+    the user's own session and changes whenever their profile is saved,
+    so that user never sees a stale snapshot in any worker.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self._cache = TTLCache(maxsize, ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, maxsize, ttl):
+        with self._lock:
+            self._cache = TTLCache(maxsize, ttl)
+
+    def get(self, key):
+        with self._lock:
+            data = self._cache.get(key)
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        user = User(**data)
+        make_transient_to_detached(user)
+        # attach to the current session without emitting a SELECT
+        return db.session.merge(user, load=False)
+
+    def set(self, key, user):
+        data = dict((c.key, getattr(user, c.key)) for c in User.__table__.columns)
+        with self._lock:
+            self._cache[key] = data
+
+    def forget(self, sid):
+        with self._lock:
+            for key in [k for k in self._cache if k[0] == sid]:
+                self._cache.pop(key, None)
+
+
+user_cache = UserCache()
 
 
 def login(user, permanent=True):
     session['sid'] = user.id
+    session['sv'] = session.get('sv', 0) + 1
     session.permanent = permanent
+    user_cache.forget(user.id)
     g.current_user = user
 
 
 def logout():
     if 'sid' in session:
+        user_cache.forget(session['sid'])
         del session['sid']
 
 
@@ -27,10 +76,14 @@ def get_current_user():
     if not sid:
         return None
 
-    user = User.query.get(sid)
-    if not user:
-        logout()
-        return None
+    key = (sid, session.get('sv', 0))
+    user = user_cache.get(key)
+    if user is None:
+        user = User.query.get(sid)
+        if not user:
+            logout()
+            return None
+        user_cache.set(key, user)
 
     g.current_user = user
     return user
@@ -56,11 +109,57 @@ def require_login(f):
     return decorated
 
 
-oauth = OAuth(cache=cache, fetch_token=fetch_token)
+class LazyOAuth(object):
+    """Authlib's ``OAuth`` registry, imported and set up on first use.
+
+    Importing authlib pulls in requests and oauthlib, and registering the
+    providers imports their factories, none of which most requests need.
+    ``oauth.github`` works as before, registering the provider the first
+    time it is asked for.
+    """
+
+    def __init__(self, providers, **kwargs):
+        self.providers = providers
+        self._kwargs = kwargs
+        self._app = None
+        self._oauth = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self._app = app
+        self._oauth = None
+
+    def _get_oauth(self):
+        if self._oauth is None:
+            with self._lock:
+                if self._oauth is None:
+                    from authlib.flask.client import OAuth
+                    self._oauth = OAuth(self._app, **self._kwargs)
+        return self._oauth
+
+    def create_client(self, name):
+        oauth = self._get_oauth()
+        if name not in oauth._registry and name in self.providers:
+            from authlib.client.apps import register_apps
+            with self._lock:
+                register_apps(oauth, [name])
+        return oauth.create_client(name)
+
+    def __getattr__(self, key):
+        if key.startswith('_'):
+            raise AttributeError(key)
+        if key in self.providers:
+            return self.create_client(key)
+        return getattr(self._get_oauth(), key)
+
+
+oauth = LazyOAuth(
+    ('google', 'twitter', 'github', 'facebook'),
+    cache=cache, fetch_token=fetch_token,
+)
 
 
 def init_app(app):
+    user_cache.configure(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
     oauth.init_app(app)
-    register_apps(oauth, [
-        'google', 'twitter', 'github', 'facebook'
-    ])
+    verifier.init_app(app)
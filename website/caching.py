@@ -0,0 +1,219 @@
+# coding: utf-8
+
+import threading
+from time import time
+from uuid import uuid4
+from collections import OrderedDict
+from werkzeug.contrib.cache import BaseCache, RedisCache, MemcachedCache
+from werkzeug.contrib.cache import FileSystemCache
+from werkzeug.urls import url_parse
+
+
+class LRUCache(BaseCache):
+    """In-process cache holding at most ``threshold`` keys. The least
+    recently used key is evicted first. Values are stored as-is, not
+    pickled, so callers must not mutate what they get back.
+    """
+
+    def __init__(self, threshold=500, default_timeout=300):
+        BaseCache.__init__(self, default_timeout)
+        self._threshold = threshold
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _normalize_timeout(self, timeout):
+        timeout = BaseCache._normalize_timeout(self, timeout)
+        if timeout > 0:
+            timeout = time() + timeout
+        return timeout
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get(self, key):
+        with self._lock:
+            item = self._cache.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires != 0 and expires <= time():
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        expires = self._normalize_timeout(timeout)
+        with self._lock:
+            self._cache[key] = (expires, value)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._threshold:
+                self._cache.popitem(last=False)
+        return True
+
+    def add(self, key, value, timeout=None):
+        if self.has(key):
+            return False
+        return self.set(key, value, timeout)
+
+    def delete(self, key):
+        with self._lock:
+            return self._cache.pop(key, None) is not None
+
+    def has(self, key):
+        return self.get(key) is not None
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+        return True
+
+
+def create_backend(url, default_timeout=300, key_prefix=None):
+    """Create a cache from an URL. Returns ``None`` when ``url`` is empty.
+
+    - ``memory://?threshold=1000``, :class:`LRUCache` in this process
+    - ``file:///tmp/cache``, :class:`FileSystemCache` shared on one host
+    - ``redis://host:6379/0`` or ``memcached://host:11211``, shared
+    """
+    if not url:
+        return None
+    uri = url_parse(url)
+    if uri.scheme == 'memory':
+        threshold = int(uri.decode_query().get('threshold', 1000))
+        return LRUCache(threshold, default_timeout)
+    if uri.scheme == 'file':
+        return FileSystemCache(uri.path, default_timeout=default_timeout)
+    if uri.scheme in ('redis', 'rediss', 'unix'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('redis is required for {!r}'.format(url))
+        client = redis.StrictRedis.from_url(url)
+        return RedisCache(client, default_timeout=default_timeout,
+                          key_prefix=key_prefix)
+    if uri.scheme == 'memcached':
+        servers = uri.netloc.split(',')
+        return MemcachedCache(servers, default_timeout=default_timeout,
+                              key_prefix=key_prefix)
+    raise ValueError('Unsupported cache backend: {!r}'.format(url))
+
+
+class FragmentCache(object):
+    """Two tier cache for rendered HTML fragments.
+
+    Every process keeps a bounded :class:`LRUCache`. When
+    ``FRAGMENT_CACHE_URL`` is set, fragments and revisions are also kept
+    in that shared backend so an invalidation in one worker is seen by
+    all of them. Without it, other workers pick up changes once their
+    local entries expire after ``FRAGMENT_CACHE_TIMEOUT`` seconds.
+
+    A revision is a random token naming the current state of something,
+    like the feed or one project. Bumping it replaces the token, and an
+    expired token is replaced too, so a token is never reused for
+    different data and is safe to put in cache keys and ETags.
+    """
+
+    def __init__(self, app=None):
+        self.local = LRUCache()
+        self.shared = None
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        timeout = app.config['FRAGMENT_CACHE_TIMEOUT']
+        self.local = LRUCache(app.config['FRAGMENT_CACHE_SIZE'], timeout)
+        self.shared = create_backend(
+            app.config.get('FRAGMENT_CACHE_URL'), timeout, 'fragment:')
+        app.extensions['fragment_cache'] = self
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is None and self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.local.set(key, value)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        if self.shared is not None:
+            self.shared.set(key, value)
+
+    def delete(self, *keys):
+        self.local.delete_many(*keys)
+        if self.shared is not None:
+            self.shared.delete_many(*keys)
+
+    def cached(self, key, render):
+        value = self.get(key)
+        if value is None:
+            value = render()
+            self.set(key, value)
+        return value
+
+    @property
+    def _revisions(self):
+        if self.shared is not None:
+            return self.shared
+        return self.local
+
+    def revision(self, name):
+        key = 'rev:' + name
+        value = self._revisions.get(key)
+        if value is None:
+            token = uuid4().hex[:16]
+            # add, not set: another worker may have created it meanwhile
+            self._revisions.add(key, token)
+            value = self._revisions.get(key) or token
+        return value
+
+    def bump(self, name):
+        self._revisions.set('rev:' + name, uuid4().hex[:16])
+
+    def feed_key(self, cursor):
+        return 'feed:{}:{}'.format(self.revision('feed'), cursor or '')
+
+    @staticmethod
+    def card_key(project_id, star_count, variant):
+        return 'card:{}:{}:{}'.format(project_id, star_count, variant)
+
+    def card_keys(self, project_id, star_count):
+        return [self.card_key(project_id, star_count, variant)
+                for variant in ('anon', 'on', 'off')]
+
+    def starred_key(self, user_id, version):
+        revision = self.revision('starred:{}'.format(user_id))
+        return 'starred:{}:{}:{}'.format(user_id, revision, version)
+
+    def invalidate_feed(self):
+        self.bump('feed')
+
+    def invalidate_project(self, project_id, star_count):
+        self.delete(*self.card_keys(project_id, star_count))
+        self.bump('project:{}'.format(project_id))
+        self.invalidate_feed()
+
+    def invalidate_user(self, user_id):
+        self.bump('user:{}'.format(user_id))
+
+    def invalidate_starred(self, user_id):
+        self.bump('starred:{}'.format(user_id))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            ratio=float(self.hits) / total if total else 0.0,
+            size=len(self.local),
+        )
+
+
+fragments = FragmentCache()
@@ -0,0 +1,134 @@
+# coding: utf-8
+"""
+Conditional GET for the HTML pages and the API.
+
+Each page gets a version from one small aggregate query over the
+``updated_at`` columns. The version, the visitor's session and the
+URL make up the ETag, so a repeat visit is answered with 304 before the
+view runs any of its queries or renders a template. API responses are
+the same for everyone, their ETag leaves the session out.
+
+Versions come from the database, so every worker builds the same ETag
+for the same data.
+"""
+
+import time
+import hashlib
+import datetime
+from functools import wraps
+from flask import request, session, current_app, make_response
+from sqlalchemy import select, func
+from .models import db, Project, User, Trending, Revision
+from .models.revision import PROJECTS
+
+
+def _user_column(user_id):
+    # stars and unstars move the user's updated_at, see Star.toggle
+    u = User.__table__
+    return select([u.c.updated_at]).where(u.c.id == user_id).as_scalar()
+
+
+def feed_version(user_id=None):
+    """Last change of the project feed, and of ``user_id``'s stars."""
+    p, r = Project.__table__, Revision.__table__
+    columns = [
+        select([func.max(p.c.updated_at)]).as_scalar(),
+        # deleted projects leave no updated_at behind, they bump a revision
+        # whose date also moves Last-Modified on
+        select([r.c.version]).where(r.c.name == PROJECTS).as_scalar(),
+        select([r.c.updated_at]).where(r.c.name == PROJECTS).as_scalar(),
+        # rebuilds reorder the trending tabs without touching a project
+        select([func.max(Trending.__table__.c.updated_at)]).as_scalar(),
+    ]
+    if user_id:
+        columns.append(_user_column(user_id))
+    return tuple(db.session.execute(select(columns)).first())
+
+
+def profile_version(user_id):
+    """Last change of anything shown on ``user_id``'s profile page.
+
+    One row per own project is read, none per star. Star counts on the
+    cards of starred projects are not part of the version, a revisit may
+    show them up to a CSRF period old.
+    """
+    p = Project.__table__
+    columns = [
+        _user_column(user_id),
+        select([func.max(p.c.updated_at)]).where(p.c.userid == user_id).as_scalar(),
+        select([func.count()]).select_from(p).where(p.c.userid == user_id).as_scalar(),
+    ]
+    return tuple(db.session.execute(select(columns)).first())
+
+
+def project_version(id):
+    p = Project.__table__
+    return tuple(db.session.execute(
+        select([p.c.updated_at]).where(p.c.id == id)
+    ).first() or (None,))
+
+
+def user_version(id):
+    u = User.__table__
+    return tuple(db.session.execute(
+        select([u.c.updated_at]).where(u.c.id == id)
+    ).first() or (None,))
+
+
+def _csrf_period():
+    # pages embed CSRF tokens, never let a browser reuse one for more
+    # than half of its lifetime
+    limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600) or 3600
+    period = limit // 2
+    return int(time.time() // period) * period
+
+
+def conditional(get_version, per_session=True):
+    """Serve GET requests with an ETag and Last-Modified built from
+    ``get_version(**view_args)``, answering 304 without calling the view
+    when the client's copy is current. Pages that don't depend on the
+    visitor pass ``per_session=False``.
+    """
+    def wrapper(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return f(*args, **kwargs)
+
+            version = get_version(*args, **kwargs)
+            dates = [v for v in version if isinstance(v, datetime.datetime)]
+            if per_session:
+                period = _csrf_period()
+                key = (
+                    version, period, request.full_path,
+                    session.get('sid'), session.get('sv'), session.get('csrf_token'),
+                )
+                dates.append(datetime.datetime.utcfromtimestamp(period))
+            else:
+                key = (version, request.full_path)
+            etag = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+            last_modified = max(dates).replace(microsecond=0) if dates else None
+
+            if request.if_none_match:
+                fresh = request.if_none_match.contains(etag)
+            else:
+                # only anonymous visitors all see the same page
+                since = request.if_modified_since
+                fresh = bool(since) and last_modified is not None and \
+                    not (per_session and 'sid' in session) and \
+                    since.replace(tzinfo=None) >= last_modified
+
+            if fresh:
+                resp = current_app.response_class(status=304)
+            else:
+                resp = make_response(f(*args, **kwargs))
+            resp.set_etag(etag)
+            resp.last_modified = last_modified
+            if per_session:
+                resp.headers['Cache-Control'] = 'private, no-cache'
+                resp.vary.add('Cookie')
+            else:
+                resp.headers['Cache-Control'] = 'no-cache'
+            return resp
+        return decorated
+    return wrapper
@@ -9,10 +9,7 @@ from wtforms.validators import StopValidation
 from .base import BaseForm
 from ..models import db, User
 from ..auth import login
-from ..auth import oauth
-
-from google.oauth2 import id_token
-from google.auth.transport import requests
+from ..idtoken import verifier
 
 
 # class ConfirmForm(BaseForm):
@@ -39,9 +36,7 @@ class AuthenticateGoogle(BaseForm):
 
     def validate_id(self, field):
         try:
-            idinfo = id_token.verify_oauth2_token(self.id.data, requests.Request(), oauth._registry['google']['client_id'])
-            if idinfo['iss'] not in ['accounts.google.com', 'https://accounts.google.com']:
-                raise ValueError('Wrong issuer.')
+            verifier.verify(self.id.data)
         except ValueError:
             # Invalid token
             pass
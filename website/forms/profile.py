@@ -3,8 +3,9 @@ from wtforms.fields.html5 import EmailField
 from wtforms.validators import DataRequired
 from wtforms.validators import StopValidation
 from .base import BaseForm
-from ..models import db, User
+from ..models import db
 from ..auth import login
+from ..caching import fragments
 
 
 class ProfileForm(BaseForm):
@@ -12,12 +13,17 @@ class ProfileForm(BaseForm):
     year = StringField()
     description = StringField()
 
-    def save(self, email):
-        user = User.query.filter_by(email=email).first()
+    def save(self, user):
         user.major = self.major.data
         user.year = self.year.data
         user.description = self.description.data
         with db.auto_commit():
             db.session.add(user)
+        fragments.invalidate_user(user.id)
         login(user, True)
-        return user
\ No newline at end of file
+        return user
+
+
+class DeleteAccountForm(BaseForm):
+    def save(self, user):
+        user.delete()
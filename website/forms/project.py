@@ -3,8 +3,10 @@ from wtforms.fields.html5 import EmailField
 from wtforms.validators import DataRequired
 from wtforms.validators import StopValidation
 from .base import BaseForm
-from ..models import db, User, Project
+from ..models import db, Project
 from ..auth import login
+from ..caching import fragments
+from ..search import search_index
 
 
 class ProjectForm(BaseForm):
@@ -14,8 +16,7 @@ class ProjectForm(BaseForm):
     start_date = StringField()
     duration = StringField()
 
-    def save(self, email):
-        user = User.query.filter_by(email=email).first()
+    def save(self, user):
         project = Project(title=self.title.data)
         project.userid = user.id
         project.name = user.name
@@ -31,4 +32,6 @@ class ProjectForm(BaseForm):
         project.duration = self.duration.data
         with db.auto_commit():
             db.session.add(project)
+        fragments.invalidate_feed()
+        search_index.add(project)
         return project
\ No newline at end of file
@@ -0,0 +1,41 @@
+# coding: utf-8
+"""
+Cooperative database access for gevent workers.
+
+gunicorn's gevent worker monkey patches sockets, so ``requests`` calls
+like fetching Google's certificates or proxied images already yield to
+other greenlets. psycopg2 talks to PostgreSQL through libpq and would
+block the whole worker on every query. Its wait callback makes libpq
+run in async mode and wait on the socket through gevent instead.
+"""
+
+
+def is_patched():
+    """Whether gevent monkey patched this process."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('socket')
+
+
+def gevent_wait_callback(conn, timeout=None):
+    from gevent.socket import wait_read, wait_write
+    from psycopg2 import extensions, OperationalError
+
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise OperationalError('Bad result from poll: {!r}'.format(state))
+
+
+def patch_psycopg():
+    from psycopg2 import extensions
+    if extensions.get_wait_callback() is not gevent_wait_callback:
+        extensions.set_wait_callback(gevent_wait_callback)
@@ -0,0 +1,172 @@
+# coding: utf-8
+"""
+Google ID token verification with cached signing certificates.
+
+``id_token.verify_oauth2_token`` downloads Google's certificates on
+every call. :class:`CertCache` keeps them for the ``max-age`` of the
+response and refreshes them in a background thread shortly before they
+expire, so verifying a token does not touch the network.
+"""
+
+import re
+import json
+import time
+import base64
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+GOOGLE_CERTS_URL = 'https://www.googleapis.com/oauth2/v1/certs'
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+
+_max_age_re = re.compile(r'max-age=(\d+)')
+
+
+def parse_max_age(cache_control, default=0):
+    m = _max_age_re.search(cache_control or '')
+    if m:
+        return int(m.group(1))
+    return default
+
+
+def _b64_int(value):
+    data = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+    return int.from_bytes(data, 'big')
+
+
+def _jwk_to_pem(key):
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicNumbers
+
+    numbers = RSAPublicNumbers(_b64_int(key['e']), _b64_int(key['n']))
+    public_key = numbers.public_key(default_backend())
+    return public_key.public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo,
+    )
+
+
+def load_certs(data):
+    """Turn a certificate response into ``{key_id: pem}``. Accepts both
+    Google's ``{key_id: x509}`` format and a JWKS ``{"keys": [...]}``.
+    """
+    if isinstance(data, (bytes, str)):
+        data = json.loads(data)
+    if 'keys' not in data:
+        return data
+    return dict(
+        (key['kid'], _jwk_to_pem(key))
+        for key in data['keys'] if key.get('kty') == 'RSA'
+    )
+
+
+def http_fetcher(url):
+    """Fetch ``url`` and return ``(certs, max_age)``."""
+    import requests
+    resp = requests.get(url, timeout=10)
+    resp.raise_for_status()
+    max_age = parse_max_age(resp.headers.get('Cache-Control'))
+    return load_certs(resp.content.decode('utf-8')), max_age
+
+
+class CertCache(object):
+    """Signing certificates cached for their ``Cache-Control`` max-age.
+
+    :param fetcher: callable taking the URL and returning
+        ``(certs, max_age)``, replace it to test without Google.
+    :param refresh_margin: seconds before expiry to refetch in the
+        background.
+    """
+
+    def __init__(self, url=GOOGLE_CERTS_URL, fetcher=http_fetcher,
+                 refresh_margin=300, min_age=60):
+        self.url = url
+        self.fetcher = fetcher
+        self.refresh_margin = refresh_margin
+        self.min_age = min_age
+        self._certs = None
+        self._fetched_at = 0
+        self._expires_at = 0
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        certs = self._certs
+        if certs is not None and time.time() < self._expires_at:
+            return certs
+        return self.refresh(self._fetched_at)
+
+    def refresh(self, stale_since=None):
+        """Fetch the certificates again. When ``stale_since`` is given,
+        another thread that fetched after it already did the work.
+        """
+        with self._lock:
+            if stale_since is not None and self._fetched_at > stale_since:
+                return self._certs
+            certs, max_age = self.fetcher(self.url)
+            max_age = max(max_age, self.min_age)
+            self._certs = certs
+            self._fetched_at = time.time()
+            self._expires_at = self._fetched_at + max_age
+            self._schedule(max_age - self.refresh_margin)
+        return certs
+
+    def clear(self):
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+            self._timer = None
+            self._certs = None
+            self._fetched_at = 0
+            self._expires_at = 0
+
+    def _schedule(self, delay):
+        if self._timer:
+            self._timer.cancel()
+        self._timer = threading.Timer(max(delay, self.min_age), self._background_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception:
+            # the cached certs stay valid until they expire, get() will
+            # fetch them again on demand after that
+            log.exception('Failed to refresh certificates from %s', self.url)
+
+
+class IDTokenVerifier(object):
+    def __init__(self, audience=None, certs=None):
+        self.audience = audience
+        self.certs = certs or CertCache()
+
+    def init_app(self, app):
+        self.audience = app.config.get('GOOGLE_CLIENT_ID')
+        self.certs.url = app.config.get('GOOGLE_CERTS_URL', GOOGLE_CERTS_URL)
+
+    def verify(self, token):
+        """Verify an ID token and return its claims. Raises ``ValueError``
+        if the token is invalid, like ``id_token.verify_oauth2_token``.
+        """
+        from google.auth import jwt
+
+        try:
+            claims = jwt.decode(token, certs=self.certs.get(), audience=self.audience)
+        except ValueError as e:
+            if 'Certificate for key id' not in str(e):
+                raise
+            # the signing keys rotated before our copy expired, refetch
+            # at most once per min_age so bogus key ids can't flood Google
+            stale_since = time.time() - self.certs.min_age
+            certs = self.certs.refresh(stale_since)
+            claims = jwt.decode(token, certs=certs, audience=self.audience)
+
+        if claims['iss'] not in GOOGLE_ISSUERS:
+            raise ValueError('Wrong issuer.')
+        return claims
+
+
+verifier = IDTokenVerifier()
@@ -0,0 +1,343 @@
+# coding: utf-8
+"""
+Thumbnails of third-party images, served by ``/image/<size>``.
+
+User and project pictures are URLs on other sites, often full size
+photos. The proxy fetches a source once, keeps the original and its
+square thumbnails in an on-disk cache keyed by the hash of the URL, and
+serves WebP to browsers that accept it, JPEG otherwise.
+
+The cache is bounded by ``IMAGE_CACHE_SIZE`` bytes. Hits refresh a
+file's access time, and the least recently used files are removed when
+the cache grows past its size. Proxy URLs are signed with the secret
+key, so the endpoint can't be used to fetch arbitrary URLs.
+
+Picture URLs still come from users, so every fetch, and every redirect
+it follows, must resolve to public addresses only, and connects to the
+address that was checked. A source that failed
+is not fetched again for ``IMAGE_FAILURE_TTL`` seconds, by any worker.
+"""
+
+import os
+import io
+import hmac
+import time
+import socket
+import hashlib
+import tempfile
+import ipaddress
+import threading
+from urllib.parse import urlsplit, urlunsplit, urljoin
+from flask import current_app, url_for
+
+#: output formats by mimetype, in order of preference
+FORMATS = (('image/webp', 'WEBP', 'webp'), ('image/jpeg', 'JPEG', 'jpg'))
+
+#: redirects followed when fetching a source
+MAX_REDIRECTS = 3
+
+
+class ImageError(Exception):
+    """The source could not be fetched or is not an image."""
+
+
+def url_hash(url):
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+
+class ImageCache(object):
+    def __init__(self, directory=None, max_size=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_source_size = 10 * 1024 * 1024
+        self.timeout = 10
+        self.failure_ttl = 300
+        self.allow_private = False
+        self._size = None
+        self._lock = threading.Lock()
+        self._fetching = {}
+
+    def init_app(self, app):
+        self.directory = app.config.get('IMAGE_CACHE_DIR') or \
+            os.path.join(tempfile.gettempdir(), 'website-images')
+        self.max_size = app.config['IMAGE_CACHE_SIZE']
+        self.max_source_size = app.config['IMAGE_MAX_SOURCE_SIZE']
+        self.failure_ttl = app.config['IMAGE_FAILURE_TTL']
+        self.allow_private = app.config['IMAGE_ALLOW_PRIVATE']
+        self._size = None
+
+    def path(self, key, suffix):
+        return os.path.join(self.directory, key[:2], '{}.{}'.format(key, suffix))
+
+    def touch(self, path):
+        # atime marks recency, mtime is left alone so ETags stay stable
+        try:
+            st = os.stat(path)
+            os.utime(path, (time.time(), st.st_mtime))
+            return True
+        except OSError:
+            return False
+
+    def write(self, path, data):
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            self._size += len(data)
+            if self._size > self.max_size:
+                self._evict()
+
+    def _files(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    yield path, os.stat(path)
+                except OSError:
+                    pass
+
+    def _scan_size(self):
+        return sum(st.st_size for _, st in self._files())
+
+    def _evict(self):
+        # other workers share the folder, start from what is on disk
+        files = sorted(self._files(), key=lambda item: item[1].st_atime)
+        size = sum(st.st_size for _, st in files)
+        target = self.max_size * 0.9
+        for path, st in files:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= st.st_size
+        self._size = size
+
+    def check_url(self, url):
+        """Raise :class:`ImageError` unless ``url`` is http(s) and its host
+        resolves to public addresses only. Return the address to connect
+        to, the name must not be resolved again.
+        """
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ImageError('{} is not an http(s) URL'.format(url))
+        try:
+            infos = socket.getaddrinfo(parts.hostname, parts.port or None,
+                                       proto=socket.IPPROTO_TCP)
+        except (socket.gaierror, UnicodeError) as e:
+            raise ImageError('Failed to resolve {}: {}'.format(parts.hostname, e))
+        addresses = [info[4][0] for info in infos]
+        if self.allow_private:
+            return addresses[0]
+        for address in addresses:
+            # drop the scope of link-local IPv6 addresses, fe80::1%eth0
+            ip = ipaddress.ip_address(address.split('%')[0])
+            mapped = getattr(ip, 'ipv4_mapped', None)
+            if mapped is not None:
+                ip = mapped
+            if not ip.is_global or ip.is_multicast:
+                raise ImageError('{} resolves to {}, not a public address'.format(url, ip))
+        return addresses[0]
+
+    def fetch(self, url):
+        import requests
+
+        source = url
+        sessions = []
+        try:
+            for _ in range(MAX_REDIRECTS + 1):
+                address = self.check_url(url)
+                # a second lookup could answer differently, connect to the
+                # address that was checked
+                session = pinned_session(urlsplit(url).hostname)
+                sessions.append(session)
+                resp = session.get(pinned_url(url, address), timeout=self.timeout,
+                                   stream=True, allow_redirects=False,
+                                   headers={'Host': host_header(url)})
+                if not resp.is_redirect:
+                    break
+                # each hop is checked before it is requested
+                url = urljoin(url, resp.headers['Location'])
+                resp.close()
+            else:
+                raise ImageError('{} redirects too often'.format(source))
+            resp.raise_for_status()
+            ctype = resp.headers.get('Content-Type', '')
+            if not ctype.startswith('image/'):
+                raise ImageError('{} is {}, not an image'.format(url, ctype))
+            buf = io.BytesIO()
+            for chunk in resp.iter_content(64 * 1024):
+                buf.write(chunk)
+                if buf.tell() > self.max_source_size:
+                    raise ImageError('{} is too large'.format(url))
+            return buf.getvalue()
+        except requests.RequestException as e:
+            raise ImageError('Failed to fetch {}: {}'.format(url, e))
+        finally:
+            for session in sessions:
+                session.close()
+
+    def source(self, url):
+        """Return the original bytes of ``url``, fetching it at most once
+        per process at a time.
+        """
+        key = url_hash(url)
+        path = self.path(key, 'src')
+        if self.touch(path):
+            with open(path, 'rb') as f:
+                return f.read()
+        failed = self.path(key, 'err')
+        if self.failed_recently(failed):
+            raise ImageError('{} failed less than {}s ago'.format(url, self.failure_ttl))
+
+        with self._lock:
+            lock = self._fetching.setdefault(key, threading.Lock())
+        with lock:
+            try:
+                if os.path.isfile(path):
+                    with open(path, 'rb') as f:
+                        return f.read()
+                if self.failed_recently(failed):
+                    raise ImageError('{} failed less than {}s ago'.format(url, self.failure_ttl))
+                try:
+                    data = self.fetch(url)
+                except ImageError:
+                    # an empty marker, its mtime is when the fetch failed
+                    self.write(failed, b'')
+                    raise
+                self.write(path, data)
+                return data
+            finally:
+                with self._lock:
+                    self._fetching.pop(key, None)
+
+    def failed_recently(self, path):
+        try:
+            return time.time() - os.stat(path).st_mtime < self.failure_ttl
+        except OSError:
+            return False
+
+    def thumbnail(self, url, size, fmt):
+        """Return the path of the ``size`` x ``size`` thumbnail of ``url``
+        in ``fmt``, one of the :data:`FORMATS`.
+        """
+        _, pil_format, ext = fmt
+        path = self.path(url_hash(url), '{}.{}'.format(size, ext))
+        if self.touch(path):
+            return path
+        self.write(path, resize(self.source(url), size, pil_format))
+        return path
+
+
+def pinned_url(url, address):
+    """``url`` with its host replaced by ``address``."""
+    parts = urlsplit(url)
+    host = address.split('%')[0]
+    if ':' in host:
+        host = '[{}]'.format(host)
+    if parts.port:
+        host = '{}:{}'.format(host, parts.port)
+    return urlunsplit(parts._replace(netloc=host))
+
+
+def host_header(url):
+    parts = urlsplit(url)
+    return parts.netloc.rpartition('@')[2]
+
+
+def pinned_session(hostname):
+    """A requests session for URLs made by :func:`pinned_url`. TLS sends
+    ``hostname`` for SNI and checks the certificate against it, not
+    against the address in the URL.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    class PinnedAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            kwargs.update(server_hostname=hostname, assert_hostname=hostname)
+            super(PinnedAdapter, self).init_poolmanager(*args, **kwargs)
+
+    session = requests.Session()
+    session.mount('https://', PinnedAdapter())
+    return session
+
+
+def resize(data, size, pil_format):
+    from PIL import Image, ImageOps
+
+    try:
+        img = Image.open(io.BytesIO(data))
+        # let JPEG decode at a reduced scale, much faster for big photos
+        img.draft('RGB', (size * 2, size * 2))
+        img = ImageOps.exif_transpose(img)
+
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGBA')
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[-1])
+            img = background
+        elif img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        # the pictures are all shown as squares with object-fit: cover
+        img = ImageOps.fit(img, (size, size), Image.LANCZOS)
+    except (IOError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        raise ImageError('Not a usable image: {}'.format(e))
+
+    out = io.BytesIO()
+    img.save(out, pil_format, quality=82)
+    return out.getvalue()
+
+
+def choose_format(accept_mimetypes):
+    # only an explicit image/webp counts, */* matches it too
+    accepted = set(value for value, quality in accept_mimetypes if quality)
+    for fmt in FORMATS:
+        if fmt[0] in accepted:
+            return fmt
+    return FORMATS[-1]
+
+
+def sign(secret_key, url, size):
+    if not isinstance(secret_key, bytes):
+        secret_key = secret_key.encode('utf-8')
+    msg = '{}:{}'.format(size, url).encode('utf-8')
+    return hmac.new(secret_key, msg, hashlib.sha256).hexdigest()[:20]
+
+
+def verify(secret_key, url, size, signature):
+    return hmac.compare_digest(sign(secret_key, url, size), signature or '')
+
+
+def thumb_url(url, size):
+    """Proxy URL of ``url`` at the smallest configured size that is at
+    least ``size`` pixels. Other than http(s) URLs are returned as is.
+    """
+    if not url or not url.startswith(('http://', 'https://')):
+        return url
+    sizes = current_app.config['IMAGE_SIZES']
+    size = next((s for s in sizes if s >= size), sizes[-1])
+    signature = sign(current_app.secret_key, url, size)
+    return url_for('image.thumbnail', size=size, url=url, s=signature)
+
+
+image_cache = ImageCache()
+
+
+def init_app(app):
+    image_cache.init_app(app)
+
+    @app.template_filter('thumb')
+    def thumb_filter(url, size=160):
+        return thumb_url(url, size)
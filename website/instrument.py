@@ -0,0 +1,203 @@
+# coding: utf-8
+"""
+Per-request SQL counts and timings.
+
+Engine events add up every statement a request executes. The totals go
+into a ``Server-Timing`` header, so they show up in the browser's
+network panel, and into one JSON log line per request on the
+``website.requests`` logger.
+
+With ``SQL_DETECT_N_PLUS_ONE`` each statement is also reduced to its
+shape, and a shape run ``SQL_N_PLUS_ONE_THRESHOLD`` times or more in one
+request is logged as a warning naming the view and the line of
+application code that issued it. Finding that line walks the stack on
+every statement, so keep this for development.
+
+With ``TEMPLATE_TIMING`` template renders are timed as well. Their time,
+less the SQL they ran, is reported as ``tpl`` in the header, and the log
+line lists the time per template.
+"""
+
+import os
+import re
+import json
+import time
+import logging
+import traceback
+from collections import Counter, defaultdict
+from flask import g, request, has_request_context
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+log = logging.getLogger('website.requests')
+nplus1_log = logging.getLogger('website.nplus1')
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_space_re = re.compile(r'\s+')
+_in_list_re = re.compile(r'\((?:\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*,)+\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*\)')
+_literal_re = re.compile(r"'[^']*'|\b\d+\b")
+
+
+def statement_shape(statement):
+    """Collapse whitespace, literals and ``IN`` lists so the same query
+    with other parameters has the same shape.
+    """
+    shape = _space_re.sub(' ', statement).strip()
+    shape = _literal_re.sub('?', shape)
+    return _in_list_re.sub('(?)', shape)
+
+
+def call_site():
+    """The innermost frame of application code, outside this module."""
+    for frame in reversed(traceback.extract_stack()[:-2]):
+        filename = os.path.abspath(frame.filename)
+        if filename.startswith(PACKAGE_DIR) and filename != os.path.abspath(__file__):
+            return '{}:{} in {}'.format(
+                os.path.relpath(filename, os.path.dirname(PACKAGE_DIR)),
+                frame.lineno, frame.name)
+    return None
+
+
+#: called with the template name and seconds after every timed render
+template_observers = []
+
+
+class QueryStats(object):
+    def __init__(self, detect=False, templates=False):
+        self.started = time.perf_counter()
+        self.count = 0
+        self.duration = 0.0
+        self.detect = detect
+        self.shapes = Counter()
+        self.sites = {}
+        self.templates = defaultdict(float) if templates else None
+        self.template_duration = 0.0
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        if self.detect:
+            shape = statement_shape(statement)
+            self.shapes[shape] += 1
+            if shape not in self.sites:
+                self.sites[shape] = call_site()
+
+    def record_template(self, name, duration, sql_duration):
+        self.templates[name] += duration
+        self.template_duration += duration - sql_duration
+
+    def repeated(self, threshold):
+        return [(shape, n, self.sites.get(shape))
+                for shape, n in self.shapes.most_common() if n >= threshold]
+
+
+def _current_stats():
+    if has_request_context():
+        return g.get('sql_stats')
+    return None
+
+
+class TimedTemplate(Template):
+    def render(self, *args, **kwargs):
+        stats = _current_stats()
+        if stats is not None and stats.templates is None:
+            stats = None
+        sql_before = stats.duration if stats else 0
+        start = time.perf_counter()
+        try:
+            return Template.render(self, *args, **kwargs)
+        finally:
+            duration = time.perf_counter() - start
+            name = self.name or 'string'
+            if stats is not None:
+                # lazy loads in the template count as db, not tpl
+                stats.record_template(name, duration, stats.duration - sql_before)
+            for observer in template_observers:
+                observer(name, duration)
+
+
+def time_templates(app, observer=None):
+    """Time the app's templates, calling ``observer`` after each render."""
+    app.jinja_env.template_class = TimedTemplate
+    if observer is not None and observer not in template_observers:
+        template_observers.append(observer)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if not started:
+        return
+    duration = time.perf_counter() - started.pop()
+    stats = _current_stats()
+    if stats is not None:
+        stats.record(statement, duration)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(context):
+    started = context.connection.info.get('query_started') if context.connection else None
+    if started:
+        started.pop()
+
+
+def _server_timing(stats, total):
+    parts = ['db;dur={:.2f};desc="{} queries"'.format(stats.duration * 1000, stats.count)]
+    if stats.templates is not None:
+        parts.append('tpl;dur={:.2f};desc="{} templates"'.format(
+            stats.template_duration * 1000, len(stats.templates)))
+    app_duration = total - stats.duration - stats.template_duration
+    parts.append('app;dur={:.2f}'.format(app_duration * 1000))
+    return ', '.join(parts)
+
+
+def init_app(app):
+    if not app.config.get('SQL_TIMING'):
+        return
+
+    detect = app.config.get('SQL_DETECT_N_PLUS_ONE')
+    threshold = app.config.get('SQL_N_PLUS_ONE_THRESHOLD', 3)
+    templates = app.config.get('TEMPLATE_TIMING')
+    if templates:
+        time_templates(app)
+
+    @app.before_request
+    def start_stats():
+        g.sql_stats = QueryStats(detect, templates)
+
+    @app.after_request
+    def report_stats(resp):
+        stats = g.pop('sql_stats', None)
+        if stats is None:
+            return resp
+        total = time.perf_counter() - stats.started
+        resp.headers.add('Server-Timing', _server_timing(stats, total))
+
+        line = dict(
+            method=request.method,
+            path=request.path,
+            endpoint=request.endpoint,
+            status=resp.status_code,
+            queries=stats.count,
+            db_ms=round(stats.duration * 1000, 2),
+            total_ms=round(total * 1000, 2),
+        )
+        if stats.templates is not None:
+            line['tpl_ms'] = round(stats.template_duration * 1000, 2)
+            line['templates'] = dict(
+                (name, round(duration * 1000, 2))
+                for name, duration in stats.templates.items())
+        log.info(json.dumps(line, sort_keys=True))
+
+        for shape, n, site in stats.repeated(threshold):
+            nplus1_log.warning(
+                'Possible N+1 in %s: %d queries of the same shape from %s: %s',
+                request.endpoint, n, site or 'an unknown call site', shape)
+        return resp
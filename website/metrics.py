@@ -0,0 +1,340 @@
+# coding: utf-8
+"""
+Request, database pool, template and cache metrics served at
+``/metrics`` in the Prometheus text format.
+
+Each worker keeps its metrics in memory and writes a snapshot to
+``METRICS_DIR/metrics-<pid>.json`` every ``METRICS_FLUSH_INTERVAL``
+seconds, and right before it answers a scrape. The worker answering a
+scrape adds up the snapshots of all workers. Counters and histograms of
+workers that exited are folded into ``archive.json`` so totals never go
+down while gunicorn recycles workers; their gauges are dropped. Without
+``METRICS_DIR`` only the answering process is reported.
+"""
+
+import os
+import json
+import time
+import glob
+import fcntl
+import tempfile
+import threading
+from contextlib import contextmanager
+from flask import g, request, current_app
+
+#: name -> (type, help, buckets)
+METRICS = {
+    'http_request_duration_seconds': (
+        'histogram', 'Request latency by endpoint, method and status.',
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)),
+    'http_requests_in_flight': (
+        'gauge', 'Requests being served.', None),
+    'db_pool_checkout_wait_seconds': (
+        'histogram', 'Time spent waiting for a pooled database connection.',
+        (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)),
+    'db_pool_size': ('gauge', 'Connections the pool keeps open.', None),
+    'db_pool_checked_out': ('gauge', 'Connections in use.', None),
+    'db_pool_overflow': ('gauge', 'Connections open beyond the pool size.', None),
+    'template_render_seconds': (
+        'histogram', 'Template render time by template.',
+        (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)),
+    'cache_requests_total': (
+        'counter', 'Cache lookups by cache and result.', None),
+}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class Registry(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+
+    def inc(self, name, labels=None, value=1):
+        key = _key(name, labels or {})
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, labels=None):
+        with self._lock:
+            self.gauges[_key(name, labels or {})] = value
+
+    def set_total(self, name, value, labels=None):
+        """Set a counter that is kept elsewhere."""
+        with self._lock:
+            self.counters[_key(name, labels or {})] = value
+
+    def add(self, name, value, labels=None):
+        key = _key(name, labels or {})
+        with self._lock:
+            self.gauges[key] = self.gauges.get(key, 0) + value
+
+    def observe(self, name, value, labels=None):
+        buckets = METRICS[name][2]
+        key = _key(name, labels or {})
+        with self._lock:
+            h = self.histograms.get(key)
+            if h is None:
+                # cumulative counts per bucket, then sum and count
+                h = self.histograms[key] = [0] * len(buckets) + [0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    h[i] += 1
+            h[-2] += value
+            h[-1] += 1
+
+    def snapshot(self):
+        def dump(items):
+            return [[name, list(labels), value] for (name, labels), value in items]
+
+        with self._lock:
+            return dict(
+                pid=os.getpid(),
+                counters=dump(self.counters.items()),
+                histograms=dump((k, list(v)) for k, v in self.histograms.items()),
+                gauges=dump(self.gauges.items()),
+            )
+
+
+registry = Registry()
+
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _write(path, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+@contextmanager
+def _dir_lock(dirname):
+    with open(os.path.join(dirname, 'lock'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class Aggregate(object):
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+
+    def merge(self, data, gauges=True):
+        for name, labels, value in data.get('counters', ()):
+            key = name, tuple(map(tuple, labels))
+            self.counters[key] = self.counters.get(key, 0) + value
+        for name, labels, value in data.get('histograms', ()):
+            key = name, tuple(map(tuple, labels))
+            h = self.histograms.get(key)
+            self.histograms[key] = value if h is None else [a + b for a, b in zip(h, value)]
+        if gauges:
+            for name, labels, value in data.get('gauges', ()):
+                key = name, tuple(map(tuple, labels))
+                self.gauges[key] = self.gauges.get(key, 0) + value
+
+    def dump(self):
+        return dict(
+            counters=[[n, list(l), v] for (n, l), v in self.counters.items()],
+            histograms=[[n, list(l), v] for (n, l), v in self.histograms.items()],
+        )
+
+
+def flush(dirname):
+    """Write this process' snapshot to ``dirname``."""
+    collect_gauges()
+    _write(os.path.join(dirname, 'metrics-{}.json'.format(os.getpid())), registry.snapshot())
+
+
+def collect(dirname=None):
+    """Aggregate the snapshots of all workers, folding exited workers
+    into the archive first.
+    """
+    agg = Aggregate()
+    if not dirname:
+        collect_gauges()
+        agg.merge(registry.snapshot())
+        return agg
+
+    flush(dirname)
+    archive_path = os.path.join(dirname, 'archive.json')
+    with _dir_lock(dirname):
+        archive = Aggregate()
+        archive.merge(_load(archive_path) or {})
+        dead = []
+        for path in glob.glob(os.path.join(dirname, 'metrics-*.json')):
+            data = _load(path)
+            if data is None:
+                continue
+            if _alive(data['pid']):
+                agg.merge(data)
+            else:
+                archive.merge(data, gauges=False)
+                dead.append(path)
+        if dead:
+            _write(archive_path, archive.dump())
+            for path in dead:
+                os.remove(path)
+    agg.merge(archive.dump(), gauges=False)
+    return agg
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for k, v in items
+    ) + '}'
+
+
+def _format_number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render(agg):
+    lines = []
+    values = dict(counter=agg.counters, gauge=agg.gauges, histogram=agg.histograms)
+    for name in sorted(METRICS):
+        kind, help, buckets = METRICS[name]
+        series = sorted((k, v) for k, v in values[kind].items() if k[0] == name)
+        lines.append('# HELP {} {}'.format(name, help))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        for (_, labels), value in series:
+            if kind != 'histogram':
+                lines.append('{}{} {}'.format(name, _format_labels(labels), _format_number(value)))
+                continue
+            for bound, count in zip(buckets, value):
+                lines.append('{}_bucket{} {}'.format(
+                    name, _format_labels(labels, ('le', bound)), count))
+            lines.append('{}_bucket{} {}'.format(
+                name, _format_labels(labels, ('le', '+Inf')), value[-1]))
+            lines.append('{}_sum{} {}'.format(name, _format_labels(labels), _format_number(value[-2])))
+            lines.append('{}_count{} {}'.format(name, _format_labels(labels), value[-1]))
+    return '\n'.join(lines) + '\n'
+
+
+def collect_gauges():
+    """Read the gauges kept elsewhere, the pool and the caches."""
+    from .models import db
+    from .caching import fragments
+    from .auth import user_cache
+
+    pool = db.engine.pool
+    if hasattr(pool, 'checkedout'):
+        registry.set('db_pool_size', pool.size())
+        registry.set('db_pool_checked_out', pool.checkedout())
+        registry.set('db_pool_overflow', max(pool.overflow(), 0))
+
+    for name, cache in (('fragment', fragments), ('user', user_cache)):
+        registry.set_total('cache_requests_total', cache.hits, dict(cache=name, result='hit'))
+        registry.set_total('cache_requests_total', cache.misses, dict(cache=name, result='miss'))
+
+
+def instrument_pool(pool):
+    """Time how long checkouts wait for a connection."""
+    if getattr(pool, '_metrics_instrumented', False):
+        return
+    do_get = pool._do_get
+
+    def timed_do_get():
+        start = time.perf_counter()
+        try:
+            return do_get()
+        finally:
+            registry.observe('db_pool_checkout_wait_seconds', time.perf_counter() - start)
+
+    pool._do_get = timed_do_get
+    pool._metrics_instrumented = True
+
+
+def _observe_template(name, seconds):
+    registry.observe('template_render_seconds', seconds, dict(template=name))
+
+
+def _on_engine_connect(conn, branch):
+    instrument_pool(conn.engine.pool)
+
+
+def _observe_request(status):
+    start = g.pop('metrics_started', None)
+    if start is None:
+        return
+    registry.add('http_requests_in_flight', -1)
+    registry.observe('http_request_duration_seconds', time.perf_counter() - start, dict(
+        endpoint=request.endpoint or 'none',
+        method=request.method,
+        status=str(status),
+    ))
+
+
+def metrics_view():
+    agg = collect(current_app.config.get('METRICS_DIR'))
+    resp = current_app.response_class(render(agg), mimetype='text/plain')
+    resp.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
+
+
+def init_app(app):
+    if not app.config.get('METRICS_ENABLED'):
+        return
+
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from .tasks import scheduler
+    from .instrument import time_templates
+
+    dirname = app.config.get('METRICS_DIR')
+    if dirname:
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname, exist_ok=True)
+        scheduler.add_job('metrics', app.config['METRICS_FLUSH_INTERVAL'], lambda: flush(dirname))
+
+    time_templates(app, _observe_template)
+    if not event.contains(Engine, 'engine_connect', _on_engine_connect):
+        event.listen(Engine, 'engine_connect', _on_engine_connect)
+
+    @app.before_request
+    def start_request():
+        g.metrics_started = time.perf_counter()
+        registry.add('http_requests_in_flight', 1)
+
+    @app.after_request
+    def end_request(resp):
+        _observe_request(resp.status_code)
+        return resp
+
+    @app.teardown_request
+    def teardown_request(exc):
+        # after_request is skipped for unhandled errors
+        _observe_request(500)
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,308 @@
+# coding: utf-8
+"""
+Versioned schema migrations, run with ``flask db upgrade``.
+
+Each migration is a function taking a connection. On PostgreSQL the
+connection is in autocommit mode, so indexes are built with
+``CREATE INDEX CONCURRENTLY`` and the tables stay writable while a
+migration runs. Migrations check the live schema before changing it, so
+they are safe to run against a database created by ``db.create_all()``.
+"""
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import MetaData, Table, Column, Integer, DateTime
+from sqlalchemy import inspect, select, text
+from sqlalchemy.exc import DBAPIError
+from .models import db, Trending, Revision
+
+cli = AppGroup('db', help='Manage the database schema.')
+
+version_table = Table(
+    'schema_version', MetaData(),
+    Column('version', Integer, nullable=False),
+)
+
+MIGRATIONS = []
+
+#: (table, columns) looked up or sorted by the application's queries.
+#: ``flask db check`` fails unless every pattern has a supporting index.
+QUERY_PATTERNS = [
+    ('user', ('email',)),
+    ('connect', ('user_id', 'name')),
+    ('project', ('userid',)),
+    ('project', ('star_count', 'id')),
+    ('project', ('updated_at',)),
+    ('star', ('userid',)),
+    ('star', ('projectid',)),
+    ('star', ('userid', 'projectid')),
+    ('trending', ('score',)),
+    ('trending', ('week_stars', 'score')),
+    ('trending', ('updated_at',)),
+]
+
+
+def migration(version):
+    def wrapper(f):
+        MIGRATIONS.append((version, f))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return f
+    return wrapper
+
+
+def _quote(conn, name):
+    return conn.dialect.identifier_preparer.quote(name)
+
+
+def index_names(conn, table):
+    insp = inspect(conn)
+    names = set(i['name'] for i in insp.get_indexes(table))
+    names.update(c['name'] for c in insp.get_unique_constraints(table))
+    return names
+
+
+def index_valid(conn, name):
+    """Whether the PostgreSQL index ``name`` can be used, ``None`` when
+    there is no such index. A ``CREATE INDEX CONCURRENTLY`` that fails
+    leaves an invalid index behind, which still shows up by name.
+    """
+    return conn.execute(text(
+        'SELECT i.indisvalid FROM pg_index i '
+        'JOIN pg_class c ON c.oid = i.indexrelid '
+        'WHERE c.relname = :name AND pg_table_is_visible(c.oid)'
+    ), name=name).scalar()
+
+
+def drop_index(conn, name):
+    conn.execute('DROP INDEX CONCURRENTLY IF EXISTS {}'.format(_quote(conn, name)))
+
+
+def create_index(conn, name, table, columns, unique=False):
+    postgresql = conn.dialect.name == 'postgresql'
+    if postgresql:
+        valid = index_valid(conn, name)
+        if valid:
+            return False
+        if valid is not None:
+            # left over from a build that failed, start again
+            drop_index(conn, name)
+    elif name in index_names(conn, table):
+        return False
+    sql = 'CREATE {}INDEX {}{} ON {} ({})'.format(
+        'UNIQUE ' if unique else '',
+        'CONCURRENTLY ' if postgresql else '',
+        _quote(conn, name),
+        _quote(conn, table),
+        ', '.join(columns),
+    )
+    try:
+        conn.execute(sql)
+    except DBAPIError as e:
+        if postgresql:
+            drop_index(conn, name)
+        raise click.ClickException(
+            'Building index {} failed, run the upgrade again: {}'.format(name, e.orig))
+    return True
+
+
+def add_column(conn, table, column):
+    """Add a nullable column. Without a default this only touches the
+    catalog on PostgreSQL, existing rows are not rewritten.
+    """
+    names = [c['name'] for c in inspect(conn).get_columns(table)]
+    if column.name in names:
+        return False
+    conn.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(
+        _quote(conn, table),
+        _quote(conn, column.name),
+        column.type.compile(dialect=conn.dialect),
+    ))
+    return True
+
+
+def create_unique_constraint(conn, name, table, columns):
+    """Build the unique index without locking writes, then attach it as
+    a constraint. SQLite cannot add constraints, the index is enough.
+    """
+    create_index(conn, name, table, columns, unique=True)
+    if conn.dialect.name != 'postgresql':
+        return
+    constraints = [c['name'] for c in inspect(conn).get_unique_constraints(table)]
+    if name not in constraints:
+        conn.execute('ALTER TABLE {0} ADD CONSTRAINT {1} UNIQUE USING INDEX {1}'.format(
+            _quote(conn, table), _quote(conn, name)))
+
+
+def dedupe_stars(conn):
+    # the old star route could insert the same star twice, and counted
+    # every copy in star_count
+    projectids = [row[0] for row in conn.execute(
+        'SELECT DISTINCT projectid FROM star '
+        'GROUP BY userid, projectid HAVING count(*) > 1'
+    )]
+    conn.execute(
+        'DELETE FROM star WHERE id NOT IN '
+        '(SELECT min(id) FROM star GROUP BY userid, projectid)'
+    )
+    for projectid in projectids:
+        conn.execute(text(
+            'UPDATE project SET star_count = '
+            '(SELECT count(*) FROM star WHERE star.projectid = project.id) '
+            'WHERE id = :id'
+        ), id=projectid)
+
+
+@migration(1)
+def add_lookup_indexes(conn):
+    duplicates = conn.execute(
+        'SELECT email FROM {} WHERE email IS NOT NULL '
+        'GROUP BY email HAVING count(*) > 1'.format(_quote(conn, 'user'))
+    ).fetchall()
+    if duplicates:
+        emails = ', '.join(row[0] for row in duplicates)
+        raise click.ClickException(
+            'Duplicate user emails must be merged first: {}'.format(emails))
+
+    create_unique_constraint(conn, 'uc_user_email', 'user', ['email'])
+    # dedupe right before the build, the old star route may still be
+    # serving. A duplicate inserted in between fails the build, and the
+    # next upgrade dedupes and builds again.
+    dedupe_stars(conn)
+    create_unique_constraint(conn, 'uc_star', 'star', ['userid', 'projectid'])
+    create_index(conn, 'ix_star_projectid', 'star', ['projectid'])
+    create_index(conn, 'ix_project_userid', 'project', ['userid'])
+    create_index(conn, 'ix_project_feed', 'project', ['star_count DESC', 'id'])
+
+
+@migration(2)
+def add_updated_at(conn):
+    for table in ('project', 'user', 'star'):
+        add_column(conn, table, Column('updated_at', DateTime))
+    create_index(conn, 'ix_project_updated_at', 'project', ['updated_at'])
+
+
+@migration(3)
+def add_trending(conn):
+    # older stars keep a NULL created_at, trending weighs them as made
+    # at its EPOCH rather than all at once on deploy
+    add_column(conn, 'star', Column('created_at', DateTime))
+    # the table starts empty, 'flask rebuild-trending' fills it
+    Trending.__table__.create(conn, checkfirst=True)
+
+
+@migration(4)
+def add_revision(conn):
+    # creating the table inserts its rows
+    Revision.__table__.create(conn, checkfirst=True)
+
+
+def head_version():
+    if not MIGRATIONS:
+        return 0
+    return MIGRATIONS[-1][0]
+
+
+def get_version(conn):
+    if not version_table.exists(conn):
+        return None
+    return conn.execute(select([version_table.c.version])).scalar()
+
+
+def set_version(conn, version):
+    version_table.create(conn, checkfirst=True)
+    if conn.execute(version_table.update().values(version=version)).rowcount:
+        return
+    conn.execute(version_table.insert().values(version=version))
+
+
+def connect():
+    conn = db.engine.connect()
+    if conn.dialect.name == 'postgresql':
+        conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+    return conn
+
+
+def upgrade(target=None):
+    if target is None:
+        target = head_version()
+
+    with connect() as conn:
+        current = get_version(conn)
+        if current is None and not inspect(conn).get_table_names():
+            # empty database, the models already describe the head schema
+            db.metadata.create_all(conn)
+            set_version(conn, target)
+            yield target, 'create all tables'
+            return
+
+        current = current or 0
+        for version, f in MIGRATIONS:
+            if current < version <= target:
+                f(conn)
+                set_version(conn, version)
+                yield version, f.__name__
+
+
+def supporting_indexes(insp, table):
+    rv = [insp.get_pk_constraint(table)['constrained_columns']]
+    rv.extend(i['column_names'] for i in insp.get_indexes(table))
+    rv.extend(c['column_names'] for c in insp.get_unique_constraints(table))
+    return rv
+
+
+def missing_indexes(insp):
+    rv = []
+    for table, columns in QUERY_PATTERNS:
+        indexes = supporting_indexes(insp, table)
+        if not any(set(cols[:len(columns)]) == set(columns) for cols in indexes):
+            rv.append((table, columns))
+    return rv
+
+
+def invalid_indexes(conn):
+    if conn.dialect.name != 'postgresql':
+        return []
+    return [row[0] for row in conn.execute(
+        'SELECT c.relname FROM pg_index i '
+        'JOIN pg_class c ON c.oid = i.indexrelid '
+        'WHERE NOT i.indisvalid AND pg_table_is_visible(c.oid)'
+    )]
+
+
+def current_version():
+    with db.engine.connect() as conn:
+        return get_version(conn) or 0
+
+
+@cli.command('upgrade')
+@click.option('--to', 'target', type=int, help='Stop at this version.')
+def upgrade_command(target):
+    """Apply pending migrations."""
+    for version, name in upgrade(target):
+        click.echo('Applied {}: {}'.format(version, name))
+    click.echo('Database is at version {}.'.format(current_version()))
+
+
+@cli.command('current')
+def current_command():
+    """Show the schema version of the database."""
+    click.echo('{} (head is {})'.format(current_version(), head_version()))
+
+
+@cli.command('check')
+def check_command():
+    """Fail if a query pattern has no supporting index."""
+    with db.engine.connect() as conn:
+        missing = missing_indexes(inspect(conn))
+        invalid = invalid_indexes(conn)
+    for table, columns in missing:
+        click.echo('No index on {}({})'.format(table, ', '.join(columns)), err=True)
+    for name in invalid:
+        click.echo('Index {} is invalid'.format(name), err=True)
+    if missing or invalid:
+        raise SystemExit(1)
+    click.echo('All {} query patterns are indexed.'.format(len(QUERY_PATTERNS)))
+
+
+def init_app(app):
+    app.cli.add_command(cli)
@@ -3,3 +3,5 @@ from .base import Base, db, cache
 from .user import User, Connect
 from .project import Project
 from .star import Star
+from .trending import Trending
+from .revision import Revision
@@ -1,13 +1,116 @@
 # coding: utf-8
 
+import time
+import random
 from contextlib import contextmanager
-from flask import g, current_app
-from flask_sqlalchemy import SQLAlchemy as _SQLAlchemy
+from flask import current_app, has_request_context
+from flask import session as http_session
+from flask_sqlalchemy import SQLAlchemy as _SQLAlchemy, SignallingSession
+from sqlalchemy import orm, event
+from sqlalchemy.sql import Select
 from werkzeug.local import LocalProxy
-from werkzeug.contrib.cache import FileSystemCache
+from ..caching import create_backend
+from .. import green
+
+
+class RoutingSession(SignallingSession):
+    """Send reads to a replica and everything else to the primary.
+
+    Once a transaction writes, its later reads go to the primary too, and
+    after it commits, the same visitor reads from the primary for
+    ``SQLALCHEMY_STICKY_SECONDS`` so they see their own writes while the
+    replicas catch up.
+    """
+
+    def __init__(self, db, **options):
+        SignallingSession.__init__(self, db, **options)
+        self.db = db
+        self.wrote = False
+        self.force_primary = False
+        self._replica = None
+
+    def _use_primary(self, clause):
+        if self.force_primary or self.wrote or self._flushing:
+            return True
+        # text() and bare connections may write, only selects are safe
+        if not isinstance(clause, Select) or clause._for_update_arg is not None:
+            return True
+        if has_request_context():
+            return http_session.get('db_sticky', 0) > time.time()
+        return False
+
+    def get_bind(self, mapper=None, clause=None):
+        replicas = self.app.config.get('SQLALCHEMY_REPLICA_URIS')
+        if not replicas or self._use_primary(clause):
+            if clause is not None and not isinstance(clause, Select):
+                self.wrote = True
+            return SignallingSession.get_bind(self, mapper, clause)
+
+        if self._replica is None:
+            # one replica per session, a request reads one consistent copy
+            key = 'replica_{}'.format(random.randrange(len(replicas)))
+            self._replica = self.db.get_engine(self.app, bind=key)
+        return self._replica
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _after_flush(session, flush_context):
+    session.wrote = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _after_commit(session):
+    if session.wrote and has_request_context():
+        seconds = session.app.config.get('SQLALCHEMY_STICKY_SECONDS', 0)
+        if seconds and session.app.config.get('SQLALCHEMY_REPLICA_URIS'):
+            http_session['db_sticky'] = time.time() + seconds
+    session.wrote = False
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _after_rollback(session):
+    session.wrote = False
 
 
 class SQLAlchemy(_SQLAlchemy):
+    def init_app(self, app):
+        replicas = app.config.get('SQLALCHEMY_REPLICA_URIS')
+        if replicas:
+            binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+            for i, uri in enumerate(replicas):
+                binds['replica_{}'.format(i)] = uri
+            app.config['SQLALCHEMY_BINDS'] = binds
+        _SQLAlchemy.init_app(self, app)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    @contextmanager
+    def primary(self):
+        """Run everything in the block on the primary, for reads that
+        decide what to write.
+        """
+        session = self.session()
+        previous = session.force_primary
+        session.force_primary = True
+        try:
+            yield
+        finally:
+            session.force_primary = previous
+
+    def apply_driver_hacks(self, app, info, options):
+        _SQLAlchemy.apply_driver_hacks(self, app, info, options)
+        if info.drivername.startswith('sqlite'):
+            return
+
+        # pool_size, max_overflow, pool_timeout and pool_recycle are
+        # read from their SQLALCHEMY_* keys by Flask-SQLAlchemy
+        if app.config.get('SQLALCHEMY_POOL_PRE_PING'):
+            options['pool_pre_ping'] = True
+
+        if info.drivername.startswith('postgresql') and green.is_patched():
+            green.patch_psycopg()
+
     @contextmanager
     def auto_commit(self, throw=True):
         try:
@@ -26,12 +129,20 @@ class Base(db.Model):
     __abstract__ = True
 
 
+def create_oauth_cache(config):
+    url = config.get('OAUTH_CACHE_URL')
+    if not url and config.get('OAUTH_CACHE_DIR'):
+        url = 'file://' + config['OAUTH_CACHE_DIR']
+    return create_backend(url or 'memory://', key_prefix='oauth:')
+
+
 def _get_cache():
-    _cache = g.get('_oauth_cache')
-    if _cache:
-        return _cache
-    _cache = FileSystemCache(current_app.config['OAUTH_CACHE_DIR'])
-    g._oauth_cache = _cache
+    # one cache per process, not per request
+    extensions = current_app.extensions
+    _cache = extensions.get('oauth_cache')
+    if _cache is None:
+        _cache = create_oauth_cache(current_app.config)
+        extensions['oauth_cache'] = _cache
     return _cache
 
 
@@ -2,18 +2,25 @@ import time
 import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy import Column
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import UniqueConstraint, Index
 from sqlalchemy import (
     Integer, String, DateTime, LargeBinary
 )
+from sqlalchemy import and_, or_
 from .base import db, Base
 
+#: what the profile page shows of a project
+PROFILE_COLUMNS = (
+    'id', 'userid', 'title', 'description', 'start_date', 'picture',
+    'star_count', 'name', 'url',
+)
+
 
 class Project(Base):
     __tablename__ = 'project'
 
     id = Column(Integer, primary_key=True)
-    userid = Column(Integer)
+    userid = Column(Integer, index=True)
     title = Column(String(80))
     description = Column(String(2556))
     start_date = Column(String(200))
@@ -22,3 +29,96 @@ class Project(Base):
     star_count = Column(Integer)
     name = Column(String(200))
     url = Column(String(200))
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow,
+                        onupdate=datetime.datetime.utcnow, index=True)
+
+    @classmethod
+    def feed(cls, after=None, limit=30, columns=None):
+        """Return one page of projects ordered by ``star_count DESC, id``.
+
+        ``after`` is the ``(star_count, id)`` of the last project on the
+        previous page. Returns the projects and the cursor of the next
+        page, or ``None`` when this is the last page. With ``columns``,
+        plain rows of those columns are returned instead of ``Project``
+        objects; they must include ``id`` and ``star_count``.
+        """
+        if columns:
+            q = db.session.query(*columns)
+        else:
+            q = cls.query
+        if after is not None:
+            star_count, id = after
+            q = q.filter(or_(
+                cls.star_count < star_count,
+                and_(cls.star_count == star_count, cls.id > id),
+            ))
+        q = q.order_by(cls.star_count.desc(), cls.id)
+        # fetch one extra row to know if there is a next page
+        projects = q.limit(limit + 1).all()
+        if len(projects) <= limit:
+            return projects, None
+        projects = projects[:limit]
+        last = projects[-1]
+        return projects, (last.star_count, last.id)
+
+    @classmethod
+    def profile(cls, userid, stars_limit=60):
+        """Return what ``userid``'s profile shows, as plain rows of
+        :data:`PROFILE_COLUMNS`: their own projects, each with a
+        ``starred`` flag, then the first page of :meth:`starred` and the
+        cursor of the next one.
+        """
+        from .star import Star
+        columns = [getattr(cls, name) for name in PROFILE_COLUMNS]
+        own = db.session.query(*columns, Star.id.isnot(None).label('starred')) \
+            .outerjoin(Star, and_(Star.projectid == cls.id, Star.userid == userid)) \
+            .filter(cls.userid == userid) \
+            .order_by(cls.id).all()
+        starred, cursor = cls.starred(userid, limit=stars_limit)
+        return own, starred, cursor
+
+    @classmethod
+    def starred(cls, userid, before=None, limit=60):
+        """Return one page of the projects of others ``userid`` starred,
+        newest project first, as plain rows of :data:`PROFILE_COLUMNS`.
+
+        ``before`` is the id of the last project on the previous page.
+        Returns the rows and the cursor of the next page, or ``None`` when
+        this is the last page.
+        """
+        from .star import Star
+        columns = [getattr(cls, name) for name in PROFILE_COLUMNS]
+        # walks the uc_star index from the cursor down and stops after the
+        # page, however many stars the user has
+        q = db.session.query(*columns) \
+            .join(Star, Star.projectid == cls.id) \
+            .filter(Star.userid == userid, cls.userid != userid)
+        if before is not None:
+            q = q.filter(Star.projectid < before)
+        rows = q.order_by(Star.projectid.desc()).limit(limit + 1).all()
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, rows[-1].id
+
+    def delete(self):
+        """Delete this project, its stars and its trending row in one
+        transaction.
+        """
+        from .star import Star
+        from .trending import Trending
+        from .revision import Revision, PROJECTS
+        from .user import User
+        with db.auto_commit():
+            # the project leaves the profiles of those who starred it
+            starrers = [userid for userid, in db.session.query(Star.userid)
+                        .filter(Star.projectid == self.id)]
+            Star.query.filter_by(projectid=self.id).delete(synchronize_session=False)
+            if starrers:
+                User.touch(starrers)
+            Trending.query.filter_by(projectid=self.id).delete(synchronize_session=False)
+            db.session.delete(self)
+            Revision.bump(PROJECTS)
+
+
+Index('ix_project_feed', Project.star_count.desc(), Project.id)
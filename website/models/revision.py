@@ -0,0 +1,36 @@
+import datetime
+from sqlalchemy import Column, DDL
+from sqlalchemy import Integer, String, DateTime
+from sqlalchemy import event
+from .base import db, Base
+
+#: bumped when projects are deleted
+PROJECTS = 'projects'
+
+
+class Revision(Base):
+    """Named counters for changes that leave no ``updated_at`` behind,
+    like deleted rows. Reading one is a primary key lookup, where
+    counting the rows would scan the table.
+    """
+
+    __tablename__ = 'revision'
+
+    name = Column(String(40), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    @classmethod
+    def bump(cls, name):
+        """Move ``name`` on, in the caller's transaction."""
+        t = cls.__table__
+        values = dict(updated_at=datetime.datetime.utcnow())
+        rv = db.session.execute(t.update().where(t.c.name == name).values(
+            version=t.c.version + 1, **values))
+        if not rv.rowcount:
+            db.session.execute(t.insert().values(name=name, version=1, **values))
+
+
+# the row exists from the start, so bumps never race to insert it
+event.listen(Revision.__table__, 'after_create', DDL(
+    "INSERT INTO revision (name, version) VALUES ('{}', 0)".format(PROJECTS)))
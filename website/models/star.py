@@ -4,14 +4,118 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy import Column
 from sqlalchemy import UniqueConstraint
 from sqlalchemy import (
-    Integer, String
+    Integer, String, DateTime
 )
+from sqlalchemy import and_, or_, func, select
+from sqlalchemy.exc import IntegrityError
 from .base import db, Base
+from .project import Project
+from .trending import Trending, EPOCH
 
 
 class Star(Base):
     __tablename__ = 'star'
+    __table_args__ = (
+        UniqueConstraint('userid', 'projectid', name='uc_star'),
+    )
 
     id = Column(Integer, primary_key=True)
     userid = Column(Integer)
-    projectid = Column(Integer)
+    projectid = Column(Integer, index=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow,
+                        onupdate=datetime.datetime.utcnow)
+
+    @classmethod
+    def toggle(cls, userid, projectid):
+        """Star or unstar a project in a single transaction. Returns a
+        ``(starred, star_count)`` tuple. Raises ``LookupError`` if the
+        project does not exist.
+        """
+        try:
+            return cls._toggle(userid, projectid)
+        except IntegrityError:
+            # a concurrent request inserted the same star, this toggle
+            # now removes it
+            return cls._toggle(userid, projectid)
+
+    @classmethod
+    def _toggle(cls, userid, projectid):
+        from .user import User
+        star = cls.__table__
+        project = Project.__table__
+        where = and_(star.c.userid == userid, star.c.projectid == projectid)
+        # the first read decides what to write, a lagging replica would
+        # miss the star and the insert would hit uc_star
+        with db.primary(), db.auto_commit():
+            # trending needs to know when a removed star was made
+            row = db.session.execute(select([star.c.created_at]).where(where)).first()
+            deleted = row is not None and db.session.execute(
+                star.delete().where(where)).rowcount
+            if deleted:
+                delta = -1
+                starred_at = row.created_at or EPOCH
+            else:
+                starred_at = datetime.datetime.utcnow()
+                db.session.execute(star.insert().values(
+                    userid=userid, projectid=projectid, created_at=starred_at))
+                delta = 1
+
+            rv = db.session.execute(
+                project.update()
+                .where(project.c.id == projectid)
+                .values(star_count=project.c.star_count + delta)
+            )
+            if not rv.rowcount:
+                raise LookupError('No such project: {}'.format(projectid))
+            star_count = db.session.execute(
+                select([project.c.star_count])
+                .where(project.c.id == projectid)
+            ).scalar()
+            Trending.record(projectid, starred_at, delta, star_count)
+            # the star list on the user's profile changed
+            User.touch([userid])
+        return delta > 0, star_count
+
+    @classmethod
+    def starred_ids(cls, userid):
+        """Ids of the projects ``userid`` starred, as a frozenset. Reads
+        only that column, from the ``uc_star`` index.
+        """
+        rows = db.session.query(cls.projectid).filter(cls.userid == userid)
+        return frozenset(projectid for projectid, in rows)
+
+    @classmethod
+    def reconcile_counts(cls, dry_run=False, batch_size=1000):
+        """Recompute ``project.star_count`` from the star table with one
+        ``GROUP BY projectid``. Returns how many projects drifted and the
+        total absolute drift.
+        """
+        star = cls.__table__
+        project = Project.__table__
+        counts = select([star.c.projectid, func.count().label('n')]) \
+            .group_by(star.c.projectid).alias('counts')
+        actual = func.coalesce(counts.c.n, 0)
+        q = select([project.c.id, project.c.star_count, actual]).select_from(
+            project.outerjoin(counts, counts.c.projectid == project.c.id)
+        ).where(or_(project.c.star_count == None, project.c.star_count != actual))
+
+        with db.primary(), db.auto_commit():
+            rows = db.session.execute(q).fetchall()
+            if not dry_run:
+                # count again at update time so concurrent toggles are kept
+                count = select([func.count()]).where(
+                    star.c.projectid == project.c.id).as_scalar()
+                ids = [row[0] for row in rows]
+                for i in range(0, len(ids), batch_size):
+                    db.session.execute(
+                        project.update()
+                        .where(project.c.id.in_(ids[i:i + batch_size]))
+                        .values(star_count=count)
+                    )
+        drift = sum(abs((row[1] or 0) - row[2]) for row in rows)
+        return dict(
+            drifted=len(rows),
+            drift=drift,
+            ids=[row[0] for row in rows],
+        )
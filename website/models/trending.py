@@ -0,0 +1,233 @@
+import math
+import datetime
+from collections import Counter
+from contextlib import contextmanager
+from sqlalchemy import Column, Index
+from sqlalchemy import Integer, Float, DateTime
+from sqlalchemy import select, text
+from .base import db, Base
+from .project import Project
+
+#: stars are weighted from this moment on, it never moves
+EPOCH = datetime.datetime(2019, 1, 1)
+#: a star counts half as much for trending after this long
+HALF_LIFE = datetime.timedelta(days=3)
+#: the window of the "this week" tab
+WEEK = datetime.timedelta(days=7)
+#: PostgreSQL advisory lock held while rebuilding
+REBUILD_LOCK = 1908311
+
+
+def star_exponent(starred_at):
+    """log2 of a star's weight, ``2 ** ((starred_at - EPOCH) / HALF_LIFE)``."""
+    return (starred_at - EPOCH).total_seconds() / HALF_LIFE.total_seconds()
+
+
+def log2_add(a, b):
+    """``log2(2 ** a + 2 ** b)`` without computing either power."""
+    if a < b:
+        a, b = b, a
+    return a + math.log2(1 + 2 ** (b - a))
+
+
+def log2_sub(a, b):
+    """``log2(2 ** a - 2 ** b)``, or ``None`` when ``b`` is not smaller."""
+    if b >= a:
+        return None
+    return a + math.log2(-math.expm1((b - a) * math.log(2)))
+
+
+class Trending(Base):
+    """Leaderboard of the trending and this week tabs, one row per
+    project with stars.
+
+    ``score`` is the sum of the weights of a project's stars, where a
+    weight doubles every ``HALF_LIFE`` after ``EPOCH``. Newer stars
+    outweigh older ones exactly as if every weight decayed over time, but
+    a score only changes when a star is added or removed, so ranking by it
+    needs no clock. It is kept as log2, the weights themselves overflow a
+    float within a decade. ``week_stars`` counts the stars of the last
+    ``WEEK``; stars leaving that window are only dropped by
+    :meth:`rebuild`.
+    """
+
+    __tablename__ = 'trending'
+
+    projectid = Column(Integer, primary_key=True, autoincrement=False)
+    score = Column(Float, nullable=False)
+    week_stars = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow,
+                        onupdate=datetime.datetime.utcnow, index=True)
+
+    @classmethod
+    def record(cls, projectid, starred_at, delta, star_count):
+        """Add (``delta`` 1) or remove (-1) a star given when it was made.
+        Runs in the caller's transaction, which must have locked the
+        project row, as updating its ``star_count`` does.
+        """
+        t = cls.__table__
+        where = t.c.projectid == projectid
+        if not star_count:
+            db.session.execute(t.delete().where(where))
+            return
+
+        row = db.session.execute(
+            select([t.c.score, t.c.week_stars]).where(where)
+        ).first()
+        recent = starred_at >= datetime.datetime.utcnow() - WEEK
+        exponent = star_exponent(starred_at)
+
+        if row is None:
+            if delta > 0 and star_count == 1:
+                db.session.execute(t.insert().values(
+                    projectid=projectid, score=exponent, week_stars=int(recent)))
+            else:
+                # the row went missing since the last rebuild
+                score, week_stars = cls.project_score(projectid)
+                db.session.execute(t.insert().values(
+                    projectid=projectid, score=score, week_stars=week_stars))
+            return
+
+        if delta > 0:
+            score = log2_add(row.score, exponent)
+        else:
+            score = log2_sub(row.score, exponent)
+        if score is None:
+            # rounding or drift left less than the star being removed
+            score, week_stars = cls.project_score(projectid)
+        else:
+            week_stars = max(row.week_stars + (delta if recent else 0), 0)
+        db.session.execute(t.update().where(where).values(
+            score=score, week_stars=week_stars,
+            updated_at=datetime.datetime.utcnow()))
+
+    @classmethod
+    def compute(cls, projectids=None, now=None):
+        """Score and week stars of every project with stars, or of
+        ``projectids``, from the star table. Returns
+        ``{projectid: (score, week_stars)}``.
+        """
+        from .star import Star
+        star = Star.__table__
+        since = (now or datetime.datetime.utcnow()) - WEEK
+        q = select([star.c.projectid, star.c.created_at])
+        if projectids is not None:
+            q = q.where(star.c.projectid.in_(projectids))
+
+        scores = {}
+        weeks = Counter()
+        rows = db.session.execute(q.execution_options(stream_results=True))
+        for pid, created_at in rows:
+            created_at = created_at or EPOCH
+            exponent = star_exponent(created_at)
+            score = scores.get(pid)
+            scores[pid] = exponent if score is None else log2_add(score, exponent)
+            if created_at >= since:
+                weeks[pid] += 1
+        return dict((pid, (score, weeks[pid])) for pid, score in scores.items())
+
+    @classmethod
+    def project_score(cls, projectid):
+        return cls.compute([projectid]).get(projectid, (0.0, 0))
+
+    @classmethod
+    def rebuild(cls, now=None, batch_size=500):
+        """Recompute the leaderboard from the star table, writing only the
+        rows that changed. Corrects drift and drops expired week stars.
+        Returns how many rows changed, or ``None`` when another rebuild
+        is running.
+
+        Projects are done in batches, each in a transaction that locks
+        the batch's project rows first, as :meth:`record` runs under
+        them, so a star toggled meanwhile is never overwritten.
+        """
+        with cls._rebuild_lock() as locked, db.primary():
+            if not locked:
+                return None
+            changed = 0
+            after = 0
+            while True:
+                with db.auto_commit():
+                    ids = cls._lock_projects(after, batch_size)
+                    if ids:
+                        changed += cls._rebuild_projects(ids, now)
+                if len(ids) < batch_size:
+                    break
+                after = ids[-1]
+
+            t, p = cls.__table__, Project.__table__
+            with db.auto_commit():
+                # rows of projects deleted without Project.delete
+                rv = db.session.execute(t.delete().where(
+                    ~t.c.projectid.in_(select([p.c.id]))))
+            return changed + rv.rowcount
+
+    @classmethod
+    @contextmanager
+    def _rebuild_lock(cls):
+        """Hold an advisory lock on PostgreSQL, on a connection of its own
+        as the batches commit, so only one process rebuilds at a time.
+        Yields whether the lock was taken.
+        """
+        engine = db.engine
+        if engine.dialect.name != 'postgresql':
+            yield True
+            return
+        with engine.connect() as conn:
+            locked = conn.execute(
+                text('SELECT pg_try_advisory_lock(:key)'), key=REBUILD_LOCK).scalar()
+            try:
+                yield locked
+            finally:
+                if locked:
+                    conn.execute(text('SELECT pg_advisory_unlock(:key)'), key=REBUILD_LOCK)
+
+    @classmethod
+    def _lock_projects(cls, after, limit):
+        p = Project.__table__
+        q = select([p.c.id]).where(p.c.id > after).order_by(p.c.id).limit(limit)
+        return [id for id, in db.session.execute(q.with_for_update())]
+
+    @classmethod
+    def _rebuild_projects(cls, ids, now):
+        t = cls.__table__
+        fresh = cls.compute(ids, now=now)
+        current = dict(
+            (pid, (score, week_stars)) for pid, score, week_stars in
+            db.session.execute(select([t.c.projectid, t.c.score, t.c.week_stars])
+                               .where(t.c.projectid.in_(ids)))
+        )
+        changed = 0
+        for pid in set(current) - set(fresh):
+            db.session.execute(t.delete().where(t.c.projectid == pid))
+            changed += 1
+        for pid, (score, week_stars) in fresh.items():
+            old = current.get(pid)
+            if old is None:
+                db.session.execute(t.insert().values(
+                    projectid=pid, score=score, week_stars=week_stars))
+            elif abs(old[0] - score) > 1e-9 or old[1] != week_stars:
+                db.session.execute(t.update().where(t.c.projectid == pid).values(
+                    score=score, week_stars=week_stars,
+                    updated_at=datetime.datetime.utcnow()))
+            else:
+                continue
+            changed += 1
+        return changed
+
+    @classmethod
+    def top(cls, tab, limit=30):
+        """The ``limit`` first projects of the ``trending`` or ``week``
+        tab, read from the leaderboard's indexes.
+        """
+        q = Project.query.join(cls, cls.projectid == Project.id)
+        if tab == 'week':
+            q = q.filter(cls.week_stars > 0) \
+                .order_by(cls.week_stars.desc(), cls.score.desc(), cls.projectid)
+        else:
+            q = q.order_by(cls.score.desc(), cls.projectid)
+        return q.limit(limit).all()
+
+
+Index('ix_trending_score', Trending.score.desc(), Trending.projectid)
+Index('ix_trending_week', Trending.week_stars.desc(), Trending.score.desc(), Trending.projectid)
@@ -7,10 +7,17 @@ from sqlalchemy import (
     Integer, String, DateTime
 )
 from .base import db, Base
+from .project import Project
+from .star import Star
+from .trending import Trending
+from .revision import Revision, PROJECTS
 
 
 class User(Base):
     __tablename__ = 'user'
+    __table_args__ = (
+        UniqueConstraint('email', name='uc_user_email'),
+    )
 
     id = Column(Integer, primary_key=True)
     email = Column(String(255))
@@ -19,6 +26,8 @@ class User(Base):
     description = Column(String(2556))
     major = Column(String(80))
     year = Column(String(6))
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow,
+                        onupdate=datetime.datetime.utcnow)
 
     def get_user_id(self):
         return self.id
@@ -50,6 +59,40 @@ class User(Base):
     def to_dict(self):
         return dict(id=self.id, name=self.name)
 
+    @classmethod
+    def touch(cls, ids):
+        """Move ``updated_at`` of the users in ``ids``, a list or a query
+        of ids, on, in the caller's transaction. Their profiles show
+        something that changed.
+        """
+        t = cls.__table__
+        db.session.execute(t.update().where(t.c.id.in_(ids)).values(
+            updated_at=datetime.datetime.utcnow()))
+
+    def delete(self):
+        """Delete this user with their projects, stars and connections in
+        one transaction. Projects the user starred lose that star, their
+        trending scores catch up at the next rebuild.
+        """
+        starred = db.session.query(Star.projectid).filter(Star.userid == self.id)
+        owned = db.session.query(Project.id).filter(Project.userid == self.id)
+        with db.auto_commit():
+            Project.query.filter(Project.id.in_(starred)).update(
+                {Project.star_count: Project.star_count - 1},
+                synchronize_session=False)
+            # the owned projects leave the profiles of those who starred them
+            User.touch(db.session.query(Star.userid).filter(
+                Star.projectid.in_(owned), Star.userid != self.id))
+            Star.query.filter(db.or_(
+                Star.userid == self.id,
+                Star.projectid.in_(owned),
+            )).delete(synchronize_session=False)
+            Trending.query.filter(Trending.projectid.in_(owned)).delete(synchronize_session=False)
+            Project.query.filter_by(userid=self.id).delete(synchronize_session=False)
+            Connect.query.filter_by(user_id=self.id).delete(synchronize_session=False)
+            db.session.delete(self)
+            Revision.bump(PROJECTS)
+
 
 class Connect(Base):
     __tablename__ = 'connect'
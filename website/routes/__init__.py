@@ -1,8 +1,12 @@
 from . import front
 from . import account
 from . import project
+from . import api
+from . import image
 
 def init_app(app):
     app.register_blueprint(account.bp, url_prefix='/account')
     app.register_blueprint(project.bp, url_prefix='/project')
+    app.register_blueprint(api.bp, url_prefix='/api')
+    app.register_blueprint(image.bp, url_prefix='/image')
     app.register_blueprint(front.bp, url_prefix='')
@@ -1,15 +1,14 @@
 from flask import Blueprint
-from flask import url_for, redirect, render_template, request
+from flask import url_for, redirect, render_template, request, current_app
 from ..auth import current_user, logout as _logout
-from ..auth import oauth, require_login
+from ..auth import require_login
 from ..forms.user import AuthenticateForm, UserCreationForm, AuthenticateGoogle
-from ..forms.profile import ProfileForm
-from ..models.user import User
+from ..forms.profile import ProfileForm, DeleteAccountForm
 from ..models.project import Project
-from ..models.star import Star
-from google.oauth2 import id_token
-from google.auth.transport import requests
-from ..models import db
+from ..idtoken import verifier
+from ..caching import fragments
+from ..conditional import conditional, profile_version
+from ..search import search_index
 
 bp = Blueprint('account', __name__)
 
@@ -27,16 +26,8 @@ def login():
 @bp.route('/login/google', methods=['POST'])
 def login_google():
     try:
-        # Specify the CLIENT_ID of the app that accesses the backend:
-        idinfo = id_token.verify_oauth2_token(request.form['idtoken'], requests.Request(), oauth._registry['google']['client_id'])
-
-        # Or, if multiple clients access the backend server:
-        # idinfo = id_token.verify_oauth2_token(token, requests.Request())
-        # if idinfo['aud'] not in [CLIENT_ID_1, CLIENT_ID_2, CLIENT_ID_3]:
-        #     raise ValueError('Could not verify audience.')
-
-        if idinfo['iss'] not in ['accounts.google.com', 'https://accounts.google.com']:
-            raise ValueError('Wrong issuer.')
+        # checks the signature, the GOOGLE_CLIENT_ID audience and the issuer
+        idinfo = verifier.verify(request.form['idtoken'])
 
         # If auth request is from a G Suite domain:
         # if idinfo['hd'] != GSUITE_DOMAIN_NAME:
@@ -71,13 +62,40 @@ def signup():
 
 @bp.route('/profile', methods=['GET', 'POST'])
 @require_login
+@conditional(lambda: profile_version(current_user.id))
 def profile():
     form = ProfileForm()
+    user = current_user._get_current_object()
+    user_id = user.id
+    if form.validate_on_submit():
+        form.save(user)
+    projects, stars, next_stars = Project.profile(
+        user_id, current_app.config['PROFILE_STARS_LIMIT'])
+    delete_form = DeleteAccountForm(prefix='delete')
+    return render_template('edit-profile.html', form=form, delete_form=delete_form, projects=projects, stars=stars, next_stars=next_stars, user=current_user)
+
+@bp.route('/profile/stars')
+@require_login
+@conditional(lambda: profile_version(current_user.id))
+def profile_stars():
+    before = request.args.get('before', type=int)
+    stars, next_stars = Project.starred(
+        current_user.id, before, current_app.config['PROFILE_STARS_LIMIT'])
+    resp = current_app.make_response(render_template('starred-cards.html', stars=stars))
+    if next_stars:
+        resp.headers['X-Next-Cursor'] = str(next_stars)
+    return resp
+
+@bp.route('/delete', methods=['POST'])
+@require_login
+def delete():
+    form = DeleteAccountForm(prefix='delete')
     if form.validate_on_submit():
-        form.save(current_user.email)
-    user = User.query.filter_by(email=current_user.email).first()
-    projects = Project.query.filter_by(userid=user.id).all()
-    stars = db.session.query(Star, Project).filter(Star.userid == user.id).filter(Project.id == Star.projectid).all()
-    starsIDs = [s[0].projectid for s in stars]
-    stars = [s for s in stars if s[1].userid != current_user.id]
-    return render_template('edit-profile.html', form=form, projects=projects, stars=stars, starsIDs=starsIDs, user=current_user)
+        user = current_user._get_current_object()
+        user_id = user.id
+        form.save(user)
+        fragments.invalidate_feed()
+        fragments.invalidate_user(user_id)
+        search_index.invalidate()
+        _logout()
+    return redirect(url_for('front.home'))
@@ -0,0 +1,87 @@
+import json
+from flask import Blueprint
+from flask import Response, request, abort, current_app
+from ..conditional import conditional, feed_version, project_version, user_version
+from ..models import db, Project, User
+from .front import parse_cursor, format_cursor
+
+API_VERSION = '1'
+MAX_LIMIT = 100
+
+bp = Blueprint('api', __name__)
+
+PROJECT_FIELDS = (
+    'id', 'userid', 'title', 'description', 'start_date',
+    'picture', 'duration', 'star_count', 'name', 'url',
+)
+USER_FIELDS = ('id', 'name', 'picture', 'description', 'major', 'year')
+
+
+def json_response(data, status=200):
+    # rows are turned into plain dicts, so the app's JSONEncoder.default
+    # and its to_dict/_asdict lookups are never needed
+    body = json.dumps(data, separators=(',', ':'))
+    resp = Response(body, status, mimetype='application/json')
+    resp.headers['API-Version'] = API_VERSION
+    return resp
+
+
+def api_error(status, message):
+    abort(json_response(dict(error=message), status))
+
+
+def get_fields(allowed):
+    value = request.args.get('fields')
+    if not value:
+        return list(allowed)
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in allowed]
+    if unknown:
+        api_error(400, 'Unknown fields: {}'.format(', '.join(unknown)))
+    return fields
+
+
+def api_version(get_version):
+    """The response format is part of every API resource's version."""
+    return lambda **kwargs: (API_VERSION,) + get_version(**kwargs)
+
+
+@bp.route('/projects')
+@bp.route('/v1/projects')
+@conditional(api_version(feed_version), per_session=False)
+def list_projects():
+    fields = get_fields(PROJECT_FIELDS)
+    limit = request.args.get('limit', current_app.config['FEED_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, MAX_LIMIT))
+
+    # the cursor is built from id and star_count
+    names = fields + [name for name in ('id', 'star_count') if name not in fields]
+    columns = [getattr(Project, name) for name in names]
+    after = parse_cursor(request.args.get('after'))
+    rows, cursor = Project.feed(after, limit, columns=columns)
+    data = [dict(zip(fields, row)) for row in rows]
+    return json_response(dict(data=data, next=format_cursor(cursor)))
+
+
+@bp.route('/projects/<int:id>')
+@bp.route('/v1/projects/<int:id>')
+@conditional(api_version(project_version), per_session=False)
+def get_project(id):
+    fields = get_fields(PROJECT_FIELDS)
+    columns = [getattr(Project, name) for name in fields]
+    row = db.session.query(*columns).filter(Project.id == id).first()
+    if row is None:
+        api_error(404, 'Project not found.')
+    return json_response(dict(data=dict(zip(fields, row))))
+
+
+@bp.route('/users/<int:id>')
+@bp.route('/v1/users/<int:id>')
+@conditional(api_version(user_version), per_session=False)
+def get_user(id):
+    fields = get_fields(USER_FIELDS)
+    columns = [getattr(User, name) for name in fields]
+    row = db.session.query(*columns).filter(User.id == id).first()
+    if row is None:
+        api_error(404, 'User not found.')
+    return json_response(dict(data=dict(zip(fields, row))))
@@ -1,22 +1,122 @@
+import os
 from flask import Blueprint
-from flask import render_template
+from flask import render_template, request, session, current_app, jsonify
+from markupsafe import Markup
 from ..auth import current_user
+from ..caching import fragments
+from ..conditional import conditional, feed_version
 from ..forms.auth import AuthenticateGoogle
 from ..models.user import User
 from ..models.project import Project
 from ..models.star import Star
+from ..models.trending import Trending
 
 
 bp = Blueprint('front', __name__)
 
+#: feed tabs besides the all time top, served from the trending leaderboard
+TABS = ('trending', 'week')
+
+
+def parse_cursor(value):
+    try:
+        star_count, id = value.split('.', 1)
+        return int(star_count), int(id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def format_cursor(cursor):
+    if cursor is None:
+        return None
+    return '{}.{}'.format(*cursor)
+
+
+def render_card(project, starsIDs):
+    if not current_user:
+        variant = 'anon'
+    elif project.id in starsIDs:
+        variant = 'on'
+    else:
+        variant = 'off'
+    key = fragments.card_key(project.id, project.star_count, variant)
+    return fragments.cached(key, lambda: render_template(
+        'project-card.html', project=project, starred=variant == 'on'))
+
+
+def render_feed_page(after, starsIDs, tab=None):
+    limit = current_app.config['FEED_PAGE_SIZE']
+    if tab:
+        # the leaderboard tabs are a single page
+        projects, cursor = Trending.top(tab, limit), None
+    else:
+        projects, cursor = Project.feed(after, limit)
+    html = '\n'.join(render_card(p, starsIDs) for p in projects)
+    return html, format_cursor(cursor)
+
+
+def get_starred_ids():
+    """Ids of the projects the current user starred, as a frozenset.
+
+    The set is cached per user. Starring bumps its revision in the
+    fragment cache. Without a shared backend, revisions are per worker,
+    so starring also bumps a counter in the user's own session. The user
+    then sees the change in every worker.
+    """
+    if not current_user:
+        return frozenset()
+    user_id = current_user.id
+    key = fragments.starred_key(user_id, session.get('stv', 0))
+    return fragments.cached(key, lambda: Star.starred_ids(user_id))
+
+
+def forget_starred_ids(user_id):
+    if fragments.shared is None:
+        session['stv'] = session.get('stv', 0) + 1
+    fragments.invalidate_starred(user_id)
+
+
+def get_tab():
+    tab = request.args.get('tab')
+    return tab if tab in TABS else None
+
+
+def get_feed_page(tab=None):
+    after = parse_cursor(request.args.get('after'))
+    if current_user:
+        starsIDs = get_starred_ids()
+        html, next_cursor = render_feed_page(after, starsIDs, tab)
+    else:
+        key = fragments.feed_key(tab or format_cursor(after))
+        html, next_cursor = fragments.cached(key, lambda: render_feed_page(after, frozenset(), tab))
+    return Markup(html), next_cursor
+
+
+def _feed_version():
+    return feed_version(current_user.id if current_user else None)
+
 
 @bp.route('/', methods=['GET', 'POST'])
+@conditional(_feed_version)
 def home():
     google_form = AuthenticateGoogle(prefix="google")
     google_form.validate_on_submit()
-    projects = Project.query.all()
-    projects = sorted(projects, key=lambda p: p.star_count, reverse=True)
-    starsIDs = []
-    if current_user:
-        starsIDs = [s.projectid for s in Star.query.filter_by(userid=current_user.id).all()]
-    return render_template('index.html', google_form=google_form, projects=projects, starsIDs=starsIDs)
+    tab = get_tab()
+    feed_html, next_cursor = get_feed_page(tab)
+    return render_template('index.html', google_form=google_form, feed_html=feed_html,
+                           next_cursor=next_cursor, tab=tab)
+
+
+@bp.route('/feed')
+@conditional(_feed_version)
+def feed():
+    feed_html, next_cursor = get_feed_page(get_tab())
+    resp = current_app.make_response(feed_html)
+    if next_cursor:
+        resp.headers['X-Next-Cursor'] = next_cursor
+    return resp
+
+
+@bp.route('/_stats/cache')
+def cache_stats():
+    return jsonify(pid=os.getpid(), fragments=fragments.stats())
@@ -0,0 +1,29 @@
+from flask import Blueprint
+from flask import request, abort, send_file, current_app
+from ..images import image_cache, choose_format, verify, ImageError
+
+bp = Blueprint('image', __name__)
+
+
+@bp.route('/<int:size>')
+def thumbnail(size):
+    url = request.args.get('url')
+    if not url or size not in current_app.config['IMAGE_SIZES']:
+        abort(404)
+    if not verify(current_app.secret_key, url, size, request.args.get('s')):
+        abort(403)
+
+    fmt = choose_format(request.accept_mimetypes)
+    try:
+        path = image_cache.thumbnail(url, size, fmt)
+    except ImageError as e:
+        current_app.logger.info('Image proxy: %s', e)
+        abort(404)
+
+    resp = send_file(
+        path, mimetype=fmt[0], conditional=True,
+        cache_timeout=current_app.config['IMAGE_MAX_AGE'],
+    )
+    resp.cache_control.public = True
+    resp.vary.add('Accept')
+    return resp
@@ -1,14 +1,17 @@
 from flask import Blueprint
 from flask import url_for, redirect, render_template, request
+from flask import abort, jsonify, current_app
+from markupsafe import Markup
 from ..auth import current_user, logout as _logout
 from ..auth import oauth, require_login
+from ..caching import fragments
+from ..search import search_index
+from .front import render_card, get_starred_ids, forget_starred_ids
 from ..forms.user import AuthenticateForm, UserCreationForm, AuthenticateGoogle
 from ..forms.profile import ProfileForm
 from ..forms.project import ProjectForm
-from google.oauth2 import id_token
 from ..models.project import Project
-from ..models import db, Star, User
-from google.auth.transport import requests
+from ..models import Star
 
 bp = Blueprint('project', __name__)
 
@@ -25,50 +28,63 @@ def edit(id):
 def create():
     form = ProjectForm()
     if form.validate_on_submit():
-        form.save(current_user.email)
+        form.save(current_user._get_current_object())
         return redirect(url_for('account.profile'), )
     return render_template('create-project.html', form=form)
 
-@bp.route('/star/<id>', methods=['POST'])
-@require_login
-def star(id):
-    id = int(id)
-    project =Project.query.filter_by(id=id).first()
-    user = User.query.filter_by(email=current_user.email).first()
-    previousStar = Star.query.filter_by(userid=user.id, projectid=id).first()
+def wants_json():
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return True
+    return request.accept_mimetypes.best == 'application/json'
 
-    if previousStar:
-        # Star did exist
-        with db.auto_commit():
-            db.session.delete(previousStar)
-        project.star_count -= 1
-    else:
-        # Star didn't exist
-        star = Star()
-        star.userid = user.id
-        star.projectid = id
-        with db.auto_commit():
-            db.session.add(star)
 
-        project.star_count += 1
+@bp.route('/star/<int:id>', methods=['POST'])
+@require_login
+def star(id):
+    # the commit expires current_user, read its id before
+    user_id = current_user.id
+    try:
+        starred, star_count = Star.toggle(user_id, id)
+    except LookupError:
+        abort(404)
 
-    with db.auto_commit():
-        db.session.add(project)
-    # db.session.add(project)
-    # db.session.commit
+    old_count = star_count - 1 if starred else star_count + 1
+    fragments.invalidate_project(id, old_count)
+    forget_starred_ids(user_id)
+    search_index.update_stars(id, star_count)
 
+    if wants_json():
+        return jsonify(id=id, starred=starred, star_count=star_count)
     return redirect(url_for('front.home'))
 
-@bp.route('/delete/<id>', methods=['POST'])
+@bp.route('/delete/<int:id>', methods=['POST'])
 @require_login
 def delete(id):
-    id = int(id)
-    user = User.query.filter_by(email=current_user.email).first()
-    project = Project.query.filter_by(id=id, userid=user.id).first()
-    stars = Star.query.filter_by(projectid=id).all()
-    with db.auto_commit():
-        db.session.delete(project)
-    for star in stars:
-        with db.auto_commit():
-            db.session.delete(star)
+    project = Project.query.filter_by(id=id, userid=current_user.id).first_or_404()
+    fragments.invalidate_project(project.id, project.star_count)
+    search_index.remove(project.id)
+    project.delete()
     return redirect(url_for('front.home'))
+
+@bp.route('/search')
+def search():
+    q = request.args.get('q', '')
+    if search_index.stale:
+        search_index.load()
+    results = search_index.search(q, current_app.config['FEED_PAGE_SIZE'])
+
+    ids = [project_id for project_id, _ in results]
+    projects = {}
+    if ids:
+        projects = dict((p.id, p) for p in Project.query.filter(Project.id.in_(ids)))
+    projects = [projects[i] for i in ids if i in projects]
+
+    if request.accept_mimetypes.best == 'application/json':
+        scores = dict(results)
+        return jsonify(query=q, results=[
+            dict(id=p.id, title=p.title, name=p.name,
+                 star_count=p.star_count, score=scores[p.id])
+            for p in projects
+        ])
+    starsIDs = get_starred_ids()
+    return Markup('\n'.join(render_card(p, starsIDs) for p in projects))
@@ -0,0 +1,218 @@
+# coding: utf-8
+"""
+In-process inverted index over project titles, descriptions and names.
+
+Every worker keeps its own index. It is updated in place when projects
+are created, starred or deleted in that worker, and rebuilt from the
+database every ``SEARCH_INDEX_MAX_AGE`` seconds to pick up changes made
+in other workers.
+"""
+
+import re
+import math
+import time
+import heapq
+import bisect
+import threading
+from collections import defaultdict
+
+_word_re = re.compile(r'\w+', re.UNICODE)
+
+#: weight of a token by the field it appears in
+FIELDS = (('title', 3.0), ('name', 2.0), ('description', 1.0))
+
+EXACT, PREFIX, TYPO = 1.0, 0.7, 0.4
+
+#: shortest token that gets typo tolerant matching
+TYPO_MIN_LENGTH = 4
+
+#: most tokens a single prefix may expand to
+MAX_EXPANSIONS = 50
+
+
+def tokenize(text):
+    if not text:
+        return []
+    return _word_re.findall(text.lower())
+
+
+def _deletes(token):
+    return set(token[:i] + token[i + 1:] for i in range(len(token)))
+
+
+class SearchIndex(object):
+    def __init__(self, max_age=300, star_weight=0.5):
+        self.max_age = max_age
+        self.star_weight = star_weight
+        self.built_at = None
+        self._sorted = True
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        #: token -> {project_id: weight}
+        self._postings = {}
+        #: project_id -> (tokens, star_count)
+        self._docs = {}
+        #: sorted tokens, for prefix matching
+        self._terms = []
+        #: token with one letter removed -> tokens, for typo matching
+        self._typos = defaultdict(set)
+
+    def init_app(self, app):
+        self.max_age = app.config['SEARCH_INDEX_MAX_AGE']
+        self.star_weight = app.config['SEARCH_STAR_WEIGHT']
+
+    def __len__(self):
+        return len(self._docs)
+
+    def _add_token(self, token):
+        self._postings[token] = {}
+        if self._sorted:
+            bisect.insort(self._terms, token)
+        else:
+            self._terms.append(token)
+        if len(token) >= TYPO_MIN_LENGTH:
+            for key in _deletes(token):
+                self._typos[key].add(token)
+
+    def _remove_token(self, token):
+        del self._postings[token]
+        i = bisect.bisect_left(self._terms, token)
+        if i < len(self._terms) and self._terms[i] == token:
+            del self._terms[i]
+        if len(token) >= TYPO_MIN_LENGTH:
+            for key in _deletes(token):
+                tokens = self._typos.get(key)
+                if tokens:
+                    tokens.discard(token)
+                    if not tokens:
+                        del self._typos[key]
+
+    def add(self, project):
+        """Index or re-index a project, any object with ``id``, the
+        :data:`FIELDS` and ``star_count`` attributes.
+        """
+        weights = defaultdict(float)
+        for field, weight in FIELDS:
+            for token in tokenize(getattr(project, field)):
+                weights[token] += weight
+
+        with self._lock:
+            self._remove(project.id)
+            for token, weight in weights.items():
+                if token not in self._postings:
+                    self._add_token(token)
+                self._postings[token][project.id] = weight
+            self._docs[project.id] = (frozenset(weights), project.star_count or 0)
+
+    def remove(self, project_id):
+        with self._lock:
+            self._remove(project_id)
+
+    def _remove(self, project_id):
+        doc = self._docs.pop(project_id, None)
+        if doc is None:
+            return
+        for token in doc[0]:
+            posting = self._postings[token]
+            posting.pop(project_id, None)
+            if not posting:
+                self._remove_token(token)
+
+    def update_stars(self, project_id, star_count):
+        with self._lock:
+            doc = self._docs.get(project_id)
+            if doc is not None:
+                self._docs[project_id] = (doc[0], star_count)
+
+    def invalidate(self):
+        self.built_at = None
+
+    def rebuild(self, projects):
+        # build aside and swap, searches keep using the old index meanwhile
+        fresh = SearchIndex()
+        fresh._sorted = False
+        for project in projects:
+            fresh.add(project)
+        fresh._terms.sort()
+        with self._lock:
+            self._postings = fresh._postings
+            self._docs = fresh._docs
+            self._terms = fresh._terms
+            self._typos = fresh._typos
+            self.built_at = time.time()
+
+    def load(self):
+        """Rebuild from the project table, reading only the indexed columns."""
+        from .models import db, Project
+        columns = [Project.id, Project.star_count]
+        columns.extend(getattr(Project, field) for field, _ in FIELDS)
+        self.rebuild(db.session.query(*columns).yield_per(1000))
+
+    @property
+    def stale(self):
+        if self.built_at is None:
+            return True
+        return self.max_age and time.time() - self.built_at > self.max_age
+
+    def expand(self, term):
+        """Return ``{token: factor}`` of indexed tokens matching ``term``
+        exactly, by prefix, or within one typo.
+        """
+        rv = {}
+        i = bisect.bisect_left(self._terms, term)
+        for token in self._terms[i:i + MAX_EXPANSIONS]:
+            if not token.startswith(term):
+                break
+            rv[token] = EXACT if token == term else PREFIX
+
+        if len(term) >= TYPO_MIN_LENGTH:
+            candidates = set(self._typos.get(term, ()))
+            for key in _deletes(term):
+                if key in self._postings:
+                    candidates.add(key)
+                candidates.update(self._typos.get(key, ()))
+            for token in candidates:
+                rv.setdefault(token, TYPO)
+        return rv
+
+    def search(self, query, limit=20):
+        """Return ``[(project_id, score)]``, best first. Every term of
+        the query must match a token exactly, as a prefix or within one
+        typo.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        with self._lock:
+            scores = None
+            for term in terms:
+                matched = defaultdict(float)
+                for token, factor in self.expand(term).items():
+                    for project_id, weight in self._postings[token].items():
+                        score = weight * factor
+                        if score > matched[project_id]:
+                            matched[project_id] = score
+                if scores is None:
+                    scores = matched
+                else:
+                    scores = dict(
+                        (project_id, score + matched[project_id])
+                        for project_id, score in scores.items()
+                        if project_id in matched
+                    )
+                if not scores:
+                    return []
+
+            docs = self._docs
+            star_weight = self.star_weight
+            ranked = (
+                (project_id, score * (1 + star_weight * math.log1p(docs[project_id][1])))
+                for project_id, score in scores.items()
+            )
+            return heapq.nlargest(limit, ranked, key=lambda item: item[1])
+
+
+search_index = SearchIndex()
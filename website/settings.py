@@ -3,4 +3,87 @@ ROOT = os.path.abspath(os.path.dirname(__file__))
 
 DEBUG = False
 SQLALCHEMY_TRACK_MODIFICATIONS = False
-ASSETS_FILE = os.path.join(ROOT, 'static/assets.json')
+#: connection pool, None keeps SQLAlchemy's defaults. With gevent workers
+#: one worker serves many requests at once, size the pool for that
+SQLALCHEMY_POOL_SIZE = None
+SQLALCHEMY_MAX_OVERFLOW = None
+SQLALCHEMY_POOL_TIMEOUT = None
+SQLALCHEMY_POOL_RECYCLE = None
+#: test connections before handing them out, survives database restarts
+SQLALCHEMY_POOL_PRE_PING = False
+#: read replicas, selects outside of write transactions go to one of them
+SQLALCHEMY_REPLICA_URIS = []
+#: seconds a visitor keeps reading from the primary after they wrote
+SQLALCHEMY_STICKY_SECONDS = 5
+#: bundles to build, see assets.py
+ASSETS_SOURCE_FILE = os.path.join(ROOT, 'static/assets.json')
+#: assets used by the templates, the manifest written by
+#: ``flask assets build`` in production
+ASSETS_FILE = ASSETS_SOURCE_FILE
+#: serve the built files from here with far-future caching, for
+#: deployments without nginx in front
+ASSETS_BUILD_DIR = None
+#: compiled templates shared by the workers, filled at deploy by
+#: ``flask compile-templates``. None compiles them in every worker
+JINJA_CACHE_DIR = None
+
+FEED_PAGE_SIZE = 30
+#: starred projects per page of the profile, the newest first
+PROFILE_STARS_LIMIT = 60
+
+#: rendered project cards and anonymous feed pages
+FRAGMENT_CACHE_SIZE = 2048
+FRAGMENT_CACHE_TIMEOUT = 60
+#: shared backend, e.g. redis://localhost:6379/1 or memcached://127.0.0.1:11211
+FRAGMENT_CACHE_URL = None
+
+#: seconds between star count reconciliations in each worker, 0 disables
+STAR_RECONCILE_INTERVAL = 0
+#: seconds between rebuilds of the trending leaderboard in each worker,
+#: which also expire the stars older than a week. 0 disables, deployments
+#: run ``flask rebuild-trending`` from cron instead
+TRENDING_REBUILD_INTERVAL = 0
+
+#: per-process cache of logged in users, see auth.UserCache
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL = 60
+
+#: OAuth state cache: memory://, file:///path, redis://host/db or
+#: memcached://host. Falls back to OAUTH_CACHE_DIR, then memory://.
+#: Use a shared backend when running more than one worker.
+OAUTH_CACHE_URL = None
+
+#: seconds between rebuilds of each worker's search index from the database
+SEARCH_INDEX_MAX_AGE = 300
+#: how much star_count boosts search relevance, score * (1 + w * log(1 + stars))
+SEARCH_STAR_WEIGHT = 0.5
+
+#: thumbnails of user and project pictures, see images.py. The cache
+#: defaults to a folder in the system temp directory
+IMAGE_CACHE_DIR = None
+IMAGE_CACHE_SIZE = 256 * 1024 * 1024
+IMAGE_MAX_SOURCE_SIZE = 10 * 1024 * 1024
+IMAGE_MAX_AGE = 30 * 24 * 3600
+#: seconds before a source that failed to fetch is tried again
+IMAGE_FAILURE_TTL = 300
+#: fetch sources on private, loopback and link-local addresses too.
+#: Only for development, picture URLs come from users
+IMAGE_ALLOW_PRIVATE = False
+#: thumbnail sizes in pixels, twice the CSS size of the avatars, cards
+#: and profile picture. The ``thumb`` filter rounds up to one of them
+IMAGE_SIZES = (96, 160, 224)
+
+#: per-request SQL counts in a Server-Timing header and a log line
+SQL_TIMING = True
+#: log statements repeated this often in one request, with their call
+#: site. Slow, for development
+SQL_DETECT_N_PLUS_ONE = False
+SQL_N_PLUS_ONE_THRESHOLD = 3
+#: time template renders too, reported next to the SQL. Needs SQL_TIMING
+TEMPLATE_TIMING = False
+
+#: Prometheus metrics at /metrics. Set METRICS_DIR to a folder shared by
+#: the gunicorn workers to report all of them, not just the one scraped
+METRICS_ENABLED = True
+METRICS_DIR = None
+METRICS_FLUSH_INTERVAL = 5
@@ -0,0 +1,163 @@
+# coding: utf-8
+"""
+Worker startup: what it costs, and how to pay for it once.
+
+``flask startup-profile`` starts a fresh interpreter with
+``-X importtime``, creates the app and reports the time spent importing
+each package and setting up each extension.
+
+With gunicorn's ``preload_app`` the master creates the app and calls
+:func:`preload`, which imports what the app otherwise loads on first
+use, compiles the templates and freezes the garbage collector, so the
+forked workers share those pages instead of each building their own
+copy. Workers call :func:`after_fork` first thing.
+
+``flask compile-templates`` fills ``JINJA_CACHE_DIR`` at deploy, so
+workers load compiled templates instead of compiling them after every
+restart.
+"""
+
+import gc
+import os
+import sys
+import json
+import importlib
+import subprocess
+from collections import defaultdict
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+#: imported by the app on first use, worth having in a preloaded master
+LAZY_MODULES = (
+    'authlib.flask.client',
+    'authlib.client.apps',
+    'google.auth.jwt',
+    'requests',
+    'PIL.Image',
+)
+
+#: what the templates folder holds besides the stylesheet sources
+TEMPLATE_EXTENSIONS = ('html', 'js')
+
+_PROFILE_SCRIPT = '''
+import json, time
+start = time.perf_counter()
+from website import create_app
+imported = time.perf_counter() - start
+timings = []
+create_app(timings=timings)
+print(json.dumps(dict(imports=imported, init=timings)))
+'''
+
+
+def parse_importtime(output):
+    """Self time in seconds of every module in ``-X importtime`` output."""
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+        modules[parts[2].strip()] = int(parts[0]) / 1e6
+    return modules
+
+
+def group_modules(modules):
+    """Add up module self times per top level package, except the app's
+    own modules which are reported one by one.
+    """
+    groups = defaultdict(float)
+    for name, seconds in modules.items():
+        if name.split('.')[0] != __package__:
+            name = name.split('.')[0]
+        groups[name] += seconds
+    return sorted(groups.items(), key=lambda item: -item[1])
+
+
+def profile_startup():
+    env = dict(os.environ, PYTHONWARNINGS='ignore')
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', _PROFILE_SCRIPT],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+        universal_newlines=True,
+    )
+    if proc.returncode:
+        raise click.ClickException(proc.stderr.strip().splitlines()[-1])
+    rv = json.loads(proc.stdout.strip().splitlines()[-1])
+    rv['modules'] = group_modules(parse_importtime(proc.stderr))
+    return rv
+
+
+@click.command('startup-profile')
+@click.option('--limit', default=20, help='Modules to list.')
+def startup_profile_command(limit):
+    """Report import and init time of the app per module."""
+    rv = profile_startup()
+    click.echo('imports {:>8.1f} ms'.format(rv['imports'] * 1000))
+    for name, seconds in rv['modules'][:limit]:
+        click.echo('  {:<48} {:>8.1f} ms'.format(name, seconds * 1000))
+    init = sum(seconds for _, seconds in rv['init'])
+    click.echo('init    {:>8.1f} ms'.format(init * 1000))
+    for name, seconds in sorted(rv['init'], key=lambda item: -item[1]):
+        click.echo('  {:<48} {:>8.1f} ms'.format(name, seconds * 1000))
+
+
+def compile_templates(app):
+    env = app.jinja_env
+    names = env.list_templates(extensions=TEMPLATE_EXTENSIONS)
+    for name in names:
+        env.get_template(name)
+    return names
+
+
+@click.command('compile-templates')
+@with_appcontext
+def compile_templates_command():
+    """Compile the templates into JINJA_CACHE_DIR."""
+    cache = current_app.jinja_env.bytecode_cache
+    if cache is None:
+        raise click.ClickException('JINJA_CACHE_DIR is not set.')
+    # templates moved or removed since the last deploy leave no files behind
+    cache.clear()
+    names = compile_templates(current_app)
+    click.echo('Compiled {} templates into {}'.format(len(names), cache.directory))
+
+
+def preload(app):
+    """Warm up a preloaded gunicorn master before it forks."""
+    from . import load_assets
+
+    for name in LAZY_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+
+    load_assets(app)
+    compile_templates(app)
+
+    # objects that live as long as the master are never collected, moving
+    # them out of the collector's reach keeps their pages shared
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+
+
+def after_fork(app):
+    """Drop connections a preloaded master may have opened, they must not
+    be shared with the worker.
+    """
+    state = app.extensions.get('sqlalchemy')
+    if state is None:
+        return
+    for connector in state.connectors.values():
+        engine = getattr(connector, '_engine', None)
+        if engine is not None:
+            engine.dispose()
+
+
+def init_app(app):
+    app.cli.add_command(startup_profile_command)
+    app.cli.add_command(compile_templates_command)
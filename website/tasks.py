@@ -0,0 +1,112 @@
+# coding: utf-8
+
+import logging
+import threading
+import click
+from flask.cli import with_appcontext
+from .caching import fragments
+from .models import Star, Trending
+from .search import search_index
+
+log = logging.getLogger(__name__)
+
+
+class Scheduler(object):
+    """Run jobs periodically in daemon threads of the current process."""
+
+    def __init__(self):
+        self.jobs = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def add_job(self, name, interval, f):
+        self.jobs[name] = (interval, f)
+
+    def start(self, app):
+        with self._lock:
+            for name, (interval, f) in self.jobs.items():
+                if name not in self._timers:
+                    self._schedule(app, name, interval, f)
+
+    def stop(self):
+        with self._lock:
+            for timer in self._timers.values():
+                timer.cancel()
+            self._timers.clear()
+
+    def _schedule(self, app, name, interval, f):
+        timer = threading.Timer(interval, self._run, (app, name, interval, f))
+        timer.daemon = True
+        timer.start()
+        self._timers[name] = timer
+
+    def _run(self, app, name, interval, f):
+        try:
+            with app.app_context():
+                f()
+        except Exception:
+            log.exception('Job %s failed', name)
+        with self._lock:
+            if name in self._timers:
+                self._schedule(app, name, interval, f)
+
+
+scheduler = Scheduler()
+
+
+def reconcile_stars(dry_run=False):
+    rv = Star.reconcile_counts(dry_run=dry_run)
+    if rv['drifted'] and not dry_run:
+        fragments.invalidate_feed()
+    if rv['drifted']:
+        log.warning('Star counts drifted on %d projects by %d stars',
+                    rv['drifted'], rv['drift'])
+    return rv
+
+
+@click.command('reconcile-stars')
+@click.option('--dry-run', is_flag=True, help='Only report the drift.')
+@with_appcontext
+def reconcile_stars_command(dry_run):
+    """Recompute project star counts from the star table."""
+    rv = reconcile_stars(dry_run)
+    click.echo('{} projects drifted, {} stars in total.'.format(
+        rv['drifted'], rv['drift']))
+
+
+def rebuild_trending():
+    changed = Trending.rebuild()
+    if changed:
+        fragments.invalidate_feed()
+    return changed
+
+
+@click.command('rebuild-trending')
+@with_appcontext
+def rebuild_trending_command():
+    """Recompute the trending leaderboard from the star table."""
+    changed = rebuild_trending()
+    if changed is None:
+        raise click.ClickException('Another rebuild is running.')
+    click.echo('{} projects changed.'.format(changed))
+
+
+def init_app(app):
+    app.cli.add_command(reconcile_stars_command)
+    app.cli.add_command(rebuild_trending_command)
+
+    interval = app.config.get('STAR_RECONCILE_INTERVAL')
+    if interval:
+        scheduler.add_job('reconcile-stars', interval, reconcile_stars)
+
+    interval = app.config.get('TRENDING_REBUILD_INTERVAL')
+    if interval:
+        scheduler.add_job('rebuild-trending', interval, rebuild_trending)
+
+    max_age = app.config.get('SEARCH_INDEX_MAX_AGE')
+    if max_age:
+        scheduler.add_job('search-index', max_age, search_index.load)
+
+    if scheduler.jobs:
+        # start in the serving process, after gunicorn has forked
+        app.before_first_request(lambda: scheduler.start(app))